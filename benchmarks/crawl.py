@@ -0,0 +1,155 @@
+"""end to end crawl and travel time throughput against the local rightmove and distance matrix servers, the requests
+a travel time grid saves over repeated searches of an area, and the cost of assembling a large crawl's records into a
+DataFrame
+
+run from the repo root: python -m benchmarks.crawl --pages 10 --latency 0.05 --workers 8
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from homing_in.crawlers import RightMoveCrawler
+from homing_in.fetcher import Fetcher
+from homing_in.records import RecordBuffer
+from homing_in.scheduler import RequestScheduler
+from homing_in.search_constructor import FixedSearch
+from homing_in.travel_grid import TravelTimeGrid
+from homing_in.travel_time import Target, travel_times
+from benchmarks.pages import FIXTURE_IDS, load_fixture, offline_search
+from benchmarks.servers import distance_matrix_server, rightmove_server, search_url, server_url
+
+TARGETS = [
+    Target('travel_time_cw', (51.50374735798869, -0.01959085464477539), '2019/07/17 08:00:00', 'TRANSIT'),
+    Target('travel_time_from_strand', (51.51412426735259, 0.11815667152404787), '2019/07/17 18:00:00', 'TRANSIT',
+           to_property=True),
+    Target('travel_time_cp', (51.415401341306435, -0.07308483123779297), '2019/07/19 22:00:00', 'TRANSIT'),
+]
+
+
+def measure_crawl(max_pages: int = 10, latency: float = 0.05, workers: int = 8, shallow_fields: tuple = ()) -> dict:
+    server = rightmove_server(latency)
+    try:
+        # a scheduler of its own, so the benchmark isn't held to (or counted against) rightmove's rate limit
+        scheduler = RequestScheduler()
+        fetcher = Fetcher(max_workers=workers, scheduler=scheduler)
+        search = FixedSearch()
+        search.search(server_url(server) + search_url(), fetcher=fetcher)
+        search_requests = sum(tally['requests'] for tally in scheduler.quota.values())
+        crawler = RightMoveCrawler(search, fetcher=fetcher, shallow_fields=shallow_fields, base_url=server_url(server))
+        start = time.perf_counter()
+        results = crawler.scrape(max_pages)
+        secs = time.perf_counter() - start
+        fetcher.close()
+    finally:
+        server.shutdown()
+    pages = sum(tally['requests'] for tally in scheduler.quota.values()) - search_requests
+    return {'max_pages': max_pages, 'latency': latency, 'workers': workers, 'properties': len(results),
+            'requests': pages, 'pages_per_sec': pages / secs, 'properties_per_sec': len(results) / secs}
+
+
+def _assemble(crawler: RightMoveCrawler, page: dict, details: dict, pages: int) -> int:
+    records = RecordBuffer(crawler._record_schema(details=True))
+    for pg in range(1, pages + 1):
+        records.extend(dict(page, id=[f'{pg}-{pid}' for pid in page['id']], page_number=pg))
+    for property_id in records.keys():
+        records.fill(property_id, details)
+    return len(records.to_frame())
+
+
+def measure_assembly(pages: int = 2000) -> dict:
+    """time and peak traced memory building the results of a pages long crawl from parsed pages, without any http"""
+    results = load_fixture('results-rent.html')
+    crawler = RightMoveCrawler(offline_search(results.decode('utf-8')))
+    page, _ = crawler._parse_results_page(results)
+    details = crawler._scrape_property(load_fixture(f'property-{FIXTURE_IDS[0]}.html'))
+    start = time.perf_counter()
+    rows = _assemble(crawler, page, details, pages)
+    secs = time.perf_counter() - start
+    tracemalloc.start()  # a second run, as tracing slows everything down
+    _assemble(crawler, page, details, pages)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'pages': pages, 'rows': rows, 'secs': secs, 'rows_per_sec': rows / secs, 'traced_peak_kb': peak // 1024}
+
+
+def measure_travel(properties: int = 2000, latency: float = 0.05, workers: int = 8) -> dict:
+    df = _random_properties(np.random.default_rng(0), properties)
+    server = distance_matrix_server(latency)
+    try:
+        start = time.perf_counter()
+        travel_times(df, TARGETS, max_workers=workers, base_url=server_url(server), scheduler=RequestScheduler())
+        secs = time.perf_counter() - start
+    finally:
+        server.shutdown()
+    lookups = properties * len(TARGETS)
+    return {'properties': properties, 'latency': latency, 'workers': workers, 'requests': server.requests,
+            'lookups_per_sec': lookups / secs}
+
+
+def _random_properties(rng: np.random.Generator, properties: int) -> pd.DataFrame:
+    return pd.DataFrame({'latitude': 51.3 + rng.random(properties) * 0.4,
+                         'longitude': -0.4 + rng.random(properties) * 0.6})
+
+
+def measure_travel_grid(searches: int = 5, properties: int = 2000, workers: int = 8) -> dict:
+    """requests per search of the same area with and without a travel time grid, each search a fresh set of
+    properties, and how far the grid's travel times are from the exact ones"""
+    rng = np.random.default_rng(0)
+    columns = [target.column for target in TARGETS]
+    server = distance_matrix_server(0)
+    exact_requests, grid_requests, errors = [], [], []
+    start = time.perf_counter()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            grid = TravelTimeGrid(os.path.join(tmp, 'grid.sqlite'))
+            for _ in range(searches):
+                df = _random_properties(rng, properties)
+                before = server.requests
+                exact = travel_times(df, TARGETS, max_workers=workers, base_url=server_url(server),
+                                     scheduler=RequestScheduler())
+                exact_requests.append(server.requests - before)
+                before = server.requests
+                estimated = travel_times(df, TARGETS, max_workers=workers, base_url=server_url(server),
+                                         scheduler=RequestScheduler(), grid=grid)
+                grid_requests.append(server.requests - before)
+                errors.append(np.abs(estimated[columns].to_numpy() - exact[columns].to_numpy()).ravel())
+            nodes = len(grid)
+            grid.close()
+    finally:
+        server.shutdown()
+    errors = np.concatenate(errors)
+    return {'searches': searches, 'properties': properties, 'exact_requests': exact_requests,
+            'grid_requests': grid_requests, 'lattice_nodes': nodes, 'mean_abs_error': float(np.mean(errors)),
+            'max_abs_error': float(np.max(errors)), 'secs': time.perf_counter() - start}
+
+
+def main(max_pages: int, properties: int, latency: float, workers: int):
+    crawl = measure_crawl(max_pages, latency, workers)
+    print(f'crawl: {crawl["properties"]} properties in {crawl["requests"]} requests, '
+          f'{crawl["pages_per_sec"]:.1f} pages/sec, {crawl["properties_per_sec"]:.1f} properties/sec')
+    shallow = measure_crawl(max_pages, latency, workers, ('beds', 'latitude', 'longitude', 'tenure'))
+    print(f'shallow crawl: {shallow["properties"]} properties in {shallow["requests"]} requests, '
+          f'{shallow["properties_per_sec"]:.1f} properties/sec')
+    assembly = measure_assembly()
+    print(f'assembly: {assembly["rows"]} rows in {assembly["secs"]:.2f} secs, '
+          f'{assembly["traced_peak_kb"]:,} kB peak traced memory')
+    travel = measure_travel(properties, latency, workers)
+    print(f'travel times: {travel["requests"]} requests, {travel["lookups_per_sec"]:,.0f} lookups/sec')
+    grid = measure_travel_grid(properties=properties, workers=workers)
+    print(f'travel time grid: requests per search {grid["exact_requests"]} exact, {grid["grid_requests"]} with the '
+          f'grid ({grid["lattice_nodes"]} nodes), mean error {grid["mean_abs_error"]:.2f} minutes')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--properties', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds the servers wait before each response')
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+    main(args.pages, args.properties, args.latency, args.workers)
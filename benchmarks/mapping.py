@@ -0,0 +1,73 @@
+"""render time and saved html size for Mapper's per-marker map against the single data layer map
+
+run from the repo root: python -m benchmarks.mapping --points 1000 10000 100000
+
+the per-marker map is only drawn up to --marker-limit points, beyond that it takes minutes and hundreds of MB
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from homing_in.mapper import Mapper
+
+
+def synthetic_results(points: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    ids = rng.choice(np.arange(60000000, 90000000), points, replace=False)
+    return pd.DataFrame({
+        'id': ids,
+        'latitude': 51.3 + rng.random(points) * 0.4,
+        'longitude': -0.4 + rng.random(points) * 0.6,
+        'total_score': rng.normal(10, 8, points).round(2),
+        'beds': rng.choice([1, 2, 3, 4], points),
+        'tenure': rng.choice(['Freehold', 'Leasehold', 'Share of Freehold', '-'], points),
+        'price': rng.integers(40, 80, points) * 10000,
+        'url': [f'http://www.rightmove.co.uk/property-for-sale/property-{i}.html' for i in ids],
+        'travel_time_angel': rng.integers(5, 90, points).astype(float),
+        'travel_time_cw': rng.integers(5, 90, points).astype(float),
+    })
+
+
+def render(results_csv: str, reference_csv: str, output_html: str, method: str) -> tuple:
+    start = time.perf_counter()
+    mapper = Mapper(results_csv)
+    getattr(mapper, method)(reference_csv)
+    mapper.save_map(output_html)
+    return time.perf_counter() - start, os.path.getsize(output_html)
+
+
+def measure(point_counts: list = (1000, 10000, 100000), marker_limit: int = 10000) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for points in point_counts:
+            df = synthetic_results(points)
+            results_csv = os.path.join(tmp, 'results.csv')
+            reference_csv = os.path.join(tmp, 'reference.csv')
+            df.to_csv(results_csv, index=False)
+            pd.DataFrame({'property_id': df['id'].iloc[:points // 20],
+                          'category': ['interested', 'remove'] * (points // 40) + ['interested'] * (points // 20 % 2)}
+                         ).to_csv(reference_csv, index=False)
+            for method in ['create_map_with_points', 'create_map_with_layer']:
+                if method == 'create_map_with_points' and points > marker_limit:
+                    continue
+                secs, size = render(results_csv, reference_csv, os.path.join(tmp, f'{method}.html'), method)
+                results[f'{method}_{points}'] = {'secs': secs, 'html_bytes': size}
+    return results
+
+
+def main(point_counts: list, marker_limit: int):
+    for name, result in measure(point_counts, marker_limit).items():
+        method, points = name.rsplit('_', 1)
+        print(f'{points:>7} points  {method:<24} {result["secs"]:8.2f}s  {result["html_bytes"] / 1024 ** 2:8.2f} MB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--marker-limit', type=int, default=10000)
+    args = parser.parse_args()
+    main(args.points, args.marker_limit)
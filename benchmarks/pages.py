@@ -0,0 +1,147 @@
+"""synthetic rightmove result and detail pages laid out the way RightMoveCrawler's xpaths expect
+
+the pages the benchmarks parse are saved in benchmarks/fixtures so every version is measured on the same bytes,
+regenerate them with: python -m benchmarks.pages
+"""
+import json
+import os
+
+import requests
+
+from homing_in.search_constructor import FixedSearch
+
+BASE_URL = 'http://www.rightmove.co.uk'
+SEARCH_PATHS = {'rent': '/property-to-rent', 'sale': '/property-for-sale'}
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+FIXTURE_IDS = [70000000 + i * 7919 for i in range(24)]
+
+
+def listing_price(property_id: int, search_type: str = 'rent') -> int:
+    return 1000 + property_id % 900 if search_type == 'rent' else 400000 + property_id % 97 * 1000
+
+
+def listing_beds(property_id: int) -> int:
+    return 2 + property_id % 2
+
+
+def listing_location(property_id: int) -> tuple:
+    return round(51.4 + property_id % 1000 / 5000, 6), round(-0.2 + property_id % 777 / 3000, 6)
+
+
+def json_model(property_ids: list, search_type: str = 'rent') -> str:
+    """the window.jsonModel script rightmove embeds in result pages, cut down to a few of its fields"""
+    properties = [{'id': pid, 'bedrooms': listing_beds(pid), 'summary': 'A bright flat close to the station.',
+                   'location': dict(zip(['latitude', 'longitude'], listing_location(pid))),
+                   'price': {'amount': listing_price(pid, search_type), 'currencyCode': 'GBP'},
+                   'propertyUrl': f'{SEARCH_PATHS[search_type]}/property-{pid}.html'}
+                  for pid in property_ids]
+    return f'<script>window.jsonModel = {json.dumps({"properties": properties})}</script>'
+
+
+def property_card(property_id: int, search_type: str = 'rent', agent_logo: bool = True) -> str:
+    price_tag = 'span' if search_type == 'rent' else 'div'
+    price = f'£{listing_price(property_id, search_type):,}' + (' pcm' if search_type == 'rent' else '')
+    agent = ('<div class="propertyCard-branchLogo"><a class="propertyCard-branchLogo-link" '
+             f'href="/estate-agents/agent/Agent-{property_id % 13}/Branch-{property_id % 7}.html">'
+             '<img alt="agent logo"/></a></div>') if agent_logo else ''
+    return f"""
+<div class="l-searchResult is-list" id="property-{property_id}">
+  <div class="propertyCard">
+    <div class="propertyCard-images"><img src="https://media.example/{property_id}.jpg" alt="photo"/></div>
+    <div class="propertyCard-details">
+      <a class="propertyCard-link" href="{SEARCH_PATHS[search_type]}/property-{property_id}.html">
+        <h2 class="propertyCard-title">
+          {listing_beds(property_id)} bedroom flat
+        </h2>
+      </a>
+      <address class="propertyCard-address"><span>{property_id % 200} Example Road, London, SE{property_id % 28}
+      </span></address>
+      <div class="propertyCard-description"><span>A bright flat close to the station with a garden.</span></div>
+    </div>
+    <div class="propertyCard-price"><{price_tag} class="propertyCard-priceValue">
+      {price}
+    </{price_tag}></div>
+    <div class="propertyCard-contactsItem">{agent}<a class="propertyCard-contactsPhoneNumber">020 7946 0000</a></div>
+  </div>
+</div>"""
+
+
+def results_page(property_ids: list, result_count: int, search_type: str = 'rent', missing_logo_every: int = 0,
+                 padding_scripts: int = 20) -> str:
+    cards = ''.join(property_card(pid, search_type, not (missing_logo_every and i % missing_logo_every == 0))
+                    for i, pid in enumerate(property_ids))
+    scripts = ''.join(f'<script>var tracking{i} = {{"page": "search", "values": [{", ".join(["1"] * 200)}]}};</script>'
+                      for i in range(padding_scripts))
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Properties in London</title>{scripts}</head>
+<body><div class="searchHeader"><span class="searchHeader-resultCount">{result_count:,}</span> results</div>
+<div id="l-searchResults">{cards}</div>{json_model(property_ids, search_type)}</body></html>"""
+
+
+def detail_page(property_id: int, padding_scripts: int = 60, trailing_scripts: int = 60, tenure: bool = True,
+                map_image: bool = True) -> str:
+    """a listing page, with padding_scripts in the head and trailing_scripts after the listing (where rightmove has
+    similar properties, its footer and more tracking)"""
+    script = '<script>var tracking{} = {{"page": "details", "values": [' + ', '.join(['1'] * 200) + ']}};</script>'
+    scripts, trailing = [''.join(script.format(i) for i in range(n)) for n in (padding_scripts, trailing_scripts)]
+    lat, long = listing_location(property_id)
+    map_img = (f'<div><a href="#map"><img src="https://media.rightmove.co.uk/map/_generate?width=190&height=190'
+               f'&zoomLevel=15&latitude={lat:.6f}&longitude={long:.6f}&signature=abc"/></a></div>') if map_image else ''
+    tenure_type = ['Leasehold', 'Freehold', 'Share of Freehold'][property_id % 3]
+    key_features = f'<span id="tenureType">{tenure_type}</span>' if tenure else '<span>Garden</span>'
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Property {property_id}</title>{scripts}</head>
+<body>
+<div id="primaryContent">
+  <div><div><div>
+    <div class="gallery"><img src="https://media.example/{property_id}.jpg"/></div>
+    <div><div><h1>{listing_beds(property_id)} bedroom flat for sale</h1><address>Example Road, London</address></div></div>
+  </div></div></div>
+</div>
+<div id="description"><div>
+  <div class="sect"><p>A bright flat close to the station with a garden.</p></div>
+  <div><div>{map_img}</div><div>{map_img}</div></div>
+</div></div>
+<div class="key-features">{key_features}</div>
+{trailing}
+</body></html>"""
+
+
+def offline_search(content: str, search_type: str = 'rent') -> FixedSearch:
+    """a FixedSearch whose response is content, as if the search url had returned it"""
+    response = requests.Response()
+    response.status_code = 200
+    response.url = f'{BASE_URL}{SEARCH_PATHS[search_type]}/find.html?locationIdentifier=STATION%5E5792'
+    response._content = content.encode('utf-8')
+    search = FixedSearch()
+    search.response = response
+    search.validated_url = True
+    search.search_type = search._check_search_type()
+    return search
+
+
+def fixture_pages() -> dict:
+    """file name to content of every saved fixture"""
+    pages = {f'results-{search_type}.html': results_page(FIXTURE_IDS, 1000, search_type)
+             for search_type in SEARCH_PATHS}
+    pages['results-missing-logos.html'] = results_page(FIXTURE_IDS, 1000, missing_logo_every=5)
+    pages.update({f'property-{pid}.html': detail_page(pid) for pid in FIXTURE_IDS[:3]})
+    pages['property-no-tenure.html'] = detail_page(FIXTURE_IDS[3], tenure=False)
+    pages['property-no-map.html'] = detail_page(FIXTURE_IDS[4], map_image=False)
+    return pages
+
+
+def save_fixtures(directory: str = FIXTURES_DIR):
+    os.makedirs(directory, exist_ok=True)
+    for name, content in fixture_pages().items():
+        with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+            f.write(content)
+
+
+def load_fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+        return f.read()
+
+
+if __name__ == '__main__':
+    save_fixtures()
@@ -0,0 +1,99 @@
+"""parse time per page for the saved result and detail page fixtures, and peak memory parsing a large detail page
+
+run from the repo root: python -m benchmarks.parsing --repeats 50
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from homing_in.crawlers import RightMoveCrawler
+from benchmarks.pages import FIXTURES_DIR, FIXTURE_IDS, detail_page, load_fixture, offline_search
+
+# run in a fresh interpreter so ru_maxrss only reflects the one page parsed
+_PEAK_MEMORY_SCRIPT = '''
+import resource
+from benchmarks.pages import detail_page, offline_search, results_page
+from homing_in.crawlers import RightMoveCrawler
+crawler = RightMoveCrawler(offline_search(results_page([1], 1)), detail_parser='{parser}')
+page = detail_page(1, trailing_scripts={scripts}).encode('utf-8')
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+crawler._scrape_property(page)
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)
+'''
+
+
+def time_per_page(parse, pages: list, rounds: int = 5) -> float:
+    """ms per page in the fastest of rounds passes over pages, which is the least disturbed by anything else running"""
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for page in pages:
+            parse(page)
+        best = min(best, time.perf_counter() - start)
+    return best / len(pages) * 1000
+
+
+def peak_memory_kb(detail_parser: str, scripts: int = 20000) -> int:
+    """growth in peak rss (kB on linux) from parsing one detail page with scripts trailing after the fields (~13MB)"""
+    script = _PEAK_MEMORY_SCRIPT.format(parser=detail_parser, scripts=scripts)
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+    return int(output.split()[-1])
+
+
+def stream_mismatches(crawler: RightMoveCrawler) -> list:
+    """detail page fixtures the stream parser reads differently to the tree parser, for either coordinate layout"""
+    mismatches = []
+    search_type = crawler.search.search_type
+    for name in sorted(f for f in os.listdir(FIXTURES_DIR) if f.startswith('property-')):
+        page = load_fixture(name)
+        for layout in ['rent', 'buy']:
+            crawler.search.search_type = layout
+            if crawler._parse_property(page) != crawler._stream_property(page):
+                mismatches.append(f'{name} ({layout})')
+    crawler.search.search_type = search_type
+    return mismatches
+
+
+def measure(repeats: int = 50) -> dict:
+    results = load_fixture('results-rent.html')
+    details = [load_fixture(f'property-{pid}.html') for pid in FIXTURE_IDS[:3]]
+    crawler = RightMoveCrawler(offline_search(results.decode('utf-8')))
+    gappy = load_fixture('results-missing-logos.html')
+    large = detail_page(FIXTURE_IDS[0], trailing_scripts=2000).encode('utf-8')
+    return {
+        'results_document_ms_per_page': time_per_page(crawler._scrape_page, [results] * repeats),
+        'results_cards_ms_per_page': time_per_page(crawler._scrape_cards, [results] * repeats),
+        'property_ms_per_page': time_per_page(crawler._parse_property, details * repeats),
+        'property_stream_ms_per_page': time_per_page(crawler._stream_property, details * repeats),
+        'property_large_ms_per_page': time_per_page(crawler._parse_property, [large] * 3),
+        'property_stream_large_ms_per_page': time_per_page(crawler._stream_property, [large] * 3),
+        'property_peak_kb': peak_memory_kb('tree'),
+        'property_stream_peak_kb': peak_memory_kb('stream'),
+        'stream_mismatches': stream_mismatches(crawler),
+        'missing_logo_rows_document': len(crawler._scrape_page(gappy)),
+        'missing_logo_rows_cards': len(crawler._scrape_cards(gappy)),
+    }
+
+
+def main(repeats: int):
+    results = measure(repeats)
+    print(f'document xpaths: {results["results_document_ms_per_page"]:.2f} ms/page')
+    print(f'per card:        {results["results_cards_ms_per_page"]:.2f} ms/page')
+    print(f'property page:   {results["property_ms_per_page"]:.2f} ms/page, '
+          f'{results["property_large_ms_per_page"]:.2f} ms for a 1.4MB page, '
+          f'{results["property_peak_kb"]:,} kB peak rss growth for a 13MB page')
+    print(f'streamed:        {results["property_stream_ms_per_page"]:.2f} ms/page, '
+          f'{results["property_stream_large_ms_per_page"]:.2f} ms for a 1.4MB page, '
+          f'{results["property_stream_peak_kb"]:,} kB peak rss growth for a 13MB page')
+    print(f'detail fixtures the stream parser reads differently: {results["stream_mismatches"] or "none"}')
+    print(f'rows from a page with 5 cards missing an agent logo: document {results["missing_logo_rows_document"]}, '
+          f'per card {results["missing_logo_rows_cards"]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=50)
+    main(parser.parse_args().repeats)
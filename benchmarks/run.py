@@ -0,0 +1,94 @@
+"""run every benchmark and write the results as json, optionally comparing them against an earlier run
+
+run from the repo root: python -m benchmarks.run --output bench.json --compare baseline.json
+"""
+import argparse
+from datetime import datetime
+import json
+import platform
+import subprocess
+
+from benchmarks import crawl, mapping, parsing, scoring, throttling
+
+# the numbers compared between runs, anything else in the results (row counts, latency, ...) is a setting
+HIGHER_IS_BETTER = ('_per_sec',)
+LOWER_IS_BETTER = ('_ms_per_page', '_peak_kb', '.secs', '.html_bytes')
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(quick: bool = False) -> dict:
+    point_counts = [1000, 10000] if quick else [1000, 10000, 100000]
+    return {
+        'commit': _git_commit(),
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': {
+            'parsing': parsing.measure(10 if quick else 50),
+            'crawl': crawl.measure_crawl(5 if quick else 10),
+            'crawl_shallow': crawl.measure_crawl(5 if quick else 10,
+                                                 shallow_fields=('beds', 'latitude', 'longitude', 'tenure')),
+            'assembly': crawl.measure_assembly(500 if quick else 2000),
+            'travel': crawl.measure_travel(500 if quick else 2000),
+            'travel_grid': crawl.measure_travel_grid(3 if quick else 5, 500 if quick else 2000),
+            'scoring': scoring.measure(10000 if quick else 100000),
+            'scoring_sweep': scoring.measure_sweep(),
+            'throttling': throttling.measure(),  # at full size even when quick, the rate needs room to recover
+            'mapping': mapping.measure(point_counts, marker_limit=1000 if quick else 10000),
+        },
+    }
+
+
+def _flatten(results: dict, prefix: str = '') -> dict:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1) -> list:
+    """metrics that got more than threshold (as a fraction) worse than in baseline"""
+    old, new = _flatten(baseline['results']), _flatten(current['results'])
+    regressions = []
+    for metric in sorted(old.keys() & new.keys()):
+        if not metric.endswith(HIGHER_IS_BETTER + LOWER_IS_BETTER) or old[metric] == 0:
+            continue
+        change = (new[metric] - old[metric]) / old[metric]
+        worse = change if metric.endswith(LOWER_IS_BETTER) else -change
+        marker = '  REGRESSION' if worse > threshold else ''
+        print(f'{metric:<55} {old[metric]:>14,.2f} -> {new[metric]:>14,.2f} {change:+8.1%}{marker}')
+        if marker:
+            regressions.append(metric)
+    return regressions
+
+
+def main(output: str, baseline: str, quick: bool, threshold: float):
+    results = run(quick)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'results written to {output}')
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(json.load(f), results, threshold)
+        if regressions:
+            raise SystemExit(f'{len(regressions)} metrics regressed by more than {threshold:.0%}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', default='bench.json')
+    parser.add_argument('--compare', dest='baseline', help='results json from an earlier run to compare against')
+    parser.add_argument('--quick', action='store_true', help='smaller inputs, for a fast check')
+    parser.add_argument('--threshold', type=float, default=0.1, help='fractional slow down reported as a regression')
+    args = parser.parse_args()
+    main(args.output, args.baseline, args.quick, args.threshold)
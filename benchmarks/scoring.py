@@ -0,0 +1,130 @@
+"""compare the row by row Scorer (as used in the examples) against the vectorised ScoringEngine, and time a sweep over
+many variants of the score mapping
+
+run from the repo root: python -m benchmarks.scoring --rows 100000
+"""
+import argparse
+import copy
+import time
+
+import numpy as np
+import pandas as pd
+
+from homing_in.scorer import Component, Scorer, ScoringEngine, parameter_grid
+
+SCORE_MAPPING = {
+    'beds': {'1': -10, '2': 0, '3': 5, '4': 5, 'other': -20},
+    'tenure': {'Freehold': 3, 'Share of Freehold': 3, 'Leasehold': 0, '-': 0, 'other': 0},
+    'price': {'max_desired': 650000, 'score_per_under': 0.25, 'score_per_over': -1.0, 'units': 10000},
+    'travel_time': {'ideal_minutes': 25, 'bad_minutes': 45, 'ideal_score': 10, 'over_ideal_cost': - 10/(45-25),
+                    'over_bad_cost': - 10/(45-25)*2},
+    'travel_time_2': {'ideal_minutes': 40, 'bad_minutes': 55, 'ideal_score': 10, 'over_ideal_cost': - 10/(55-40),
+                      'over_bad_cost': - 10/(55-40)*2},
+}
+
+# 1000 variants of SCORE_MAPPING
+SWEEP_GRID = {
+    ('price', 'max_desired'): [550000, 600000, 650000, 700000, 750000],
+    ('beds', '3'): [0, 5, 10, 15, 20],
+    ('tenure', 'Freehold'): [0, 3],
+    ('travel_time', 'ideal_minutes'): [15, 20, 25, 30, 35],
+    ('travel_time', 'bad_minutes'): [45, 50, 55, 60],
+}
+
+COMPONENTS = [
+    Component('bedroom_score', 'beds', 'value_map', 'beds'),
+    Component('tenure_score', 'tenure', 'value_map', 'tenure'),
+    Component('price_score', 'price', 'price', 'price'),
+    Component('tt_score_cw', 'travel_time_cw', 'travel_time', 'travel_time'),
+    Component('tt_score_from_strand', 'travel_time_from_strand', 'travel_time', 'travel_time_2'),
+    Component('tt_score_cp', 'travel_time_cp', 'travel_time', 'travel_time', 0.5),
+]
+
+
+def synthetic_properties(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'beds': rng.choice(['1', '2', '3', '4', '5', '-'], rows),
+        'tenure': rng.choice(['Freehold', 'Share of Freehold', 'Leasehold', '-', 'Commonhold'], rows),
+        'price': rng.integers(40, 80, rows) * 10000,
+        'travel_time_cw': rng.integers(5, 90, rows).astype(float),
+        'travel_time_from_strand': rng.integers(5, 90, rows).astype(float),
+        'travel_time_cp': rng.integers(5, 90, rows).astype(float),
+    })
+    df.loc[df.sample(frac=0.02, random_state=seed).index, 'travel_time_cp'] = np.nan  # failed lookups
+    return df
+
+
+def score_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """the examples' scoring, one apply per component"""
+    df = df.copy()
+    for column, source, kind, mapping_key, weight in COMPONENTS:
+        params = SCORE_MAPPING[mapping_key]
+        if kind == 'value_map':
+            score = df.apply(lambda x: Scorer.value_map(x[source], params), axis=1)
+        else:
+            func = getattr(Scorer, kind)
+            score = df.apply(lambda x: func(x[source], **params), axis=1)
+        df[column] = score if weight == 1 else score * weight
+    df['total_score'] = df[[c.column for c in COMPONENTS]].sum(axis=1)
+    return df
+
+
+def _variant_mapping(variant: dict) -> dict:
+    mapping = copy.deepcopy(SCORE_MAPPING)
+    for (mapping_key, param), value in variant.items():
+        mapping[mapping_key][param] = value
+    return mapping
+
+
+def measure_sweep(rows: int = 10000, k: int = 20) -> dict:
+    """a sweep over SWEEP_GRID, checked against scoring a few of its variants one at a time"""
+    df = synthetic_properties(rows)
+    engine = ScoringEngine(SCORE_MAPPING, COMPONENTS)
+    variants = parameter_grid(SWEEP_GRID)
+    start = time.perf_counter()
+    sweep = engine.sweep(df, variants, k)
+    secs = time.perf_counter() - start
+    identical = True
+    for i in range(0, len(variants), len(variants) // 5):
+        totals = ScoringEngine(_variant_mapping(variants[i]), COMPONENTS).score(df)['total_score'].to_numpy()
+        identical &= np.array_equal(totals, sweep.totals[:, i])
+        identical &= np.array_equal(np.sort(totals)[::-1][:k], totals[sweep.top[i]])
+    return {'rows': rows, 'variants': len(variants), 'secs': secs, 'sweep_variants_per_sec': len(variants) / secs,
+            'identical': bool(identical)}
+
+
+def measure(rows: int = 100000) -> dict:
+    df = synthetic_properties(rows)
+    engine = ScoringEngine(SCORE_MAPPING, COMPONENTS)
+
+    start = time.perf_counter()
+    expected = score_rows(df)
+    row_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = engine.score(df)
+    engine_secs = time.perf_counter() - start
+
+    columns = [c.column for c in COMPONENTS] + ['total_score']
+    identical = all(np.array_equal(expected[c].to_numpy(float), result[c].to_numpy(float), equal_nan=True)
+                    for c in columns)
+    return {'rows': rows, 'scorer_rows_per_sec': rows / row_secs, 'engine_rows_per_sec': rows / engine_secs,
+            'identical': identical}
+
+
+def main(rows: int):
+    results = measure(rows)
+    print(f'rows: {rows}')
+    print(f'Scorer (apply):  {results["scorer_rows_per_sec"]:,.0f} rows/sec')
+    print(f'ScoringEngine:   {results["engine_rows_per_sec"]:,.0f} rows/sec')
+    print(f'identical scores: {results["identical"]}')
+    sweep = measure_sweep()
+    print(f'sweep: {sweep["variants"]} variants of {sweep["rows"]:,} rows in {sweep["secs"]:.2f} secs, '
+          f'identical to scoring each variant: {sweep["identical"]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    main(parser.parse_args().rows)
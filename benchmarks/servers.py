@@ -0,0 +1,139 @@
+"""local stand ins for rightmove and the distance matrix api, so crawls and travel time lookups can be timed offline
+
+both servers answer on 127.0.0.1 after sleeping latency seconds per request, to mimic the round trip to the real site.
+they count the requests they get in server.requests, and can be told to push back on chosen requests (by number,
+counting from 1) the way the real sites do, so the scheduler's retries and rate limiting can be exercised:
+throttled requests get a 429 from rightmove and OVER_QUERY_LIMIT from the distance matrix api, and errors a 503 and
+UNKNOWN_ERROR. server.injected counts the faults answered
+"""
+from collections import Counter
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import re
+import threading
+import time
+from typing import Iterable
+from urllib.parse import parse_qs, urlsplit
+
+from benchmarks.pages import SEARCH_PATHS, detail_page, listing_beds, listing_price, results_page
+
+RESULTS_PER_PAGE = 24
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep alive, as the real servers do
+    latency = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def body(self, path: str, query: dict) -> tuple:
+        """content type and body for the request"""
+        raise NotImplementedError
+
+    def fault(self, fault: str) -> tuple:
+        """status, content type and body for a request answered with fault, 'throttled' or 'error'"""
+        status = 429 if fault == 'throttled' else 503
+        return status, 'text/plain', f'{status} {fault}'.encode('utf-8')
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            fault = server.faults.get(server.requests)
+            if fault is not None:
+                server.injected[fault] += 1
+        url = urlsplit(self.path)
+        if fault is None:
+            status, (content_type, body) = 200, self.body(url.path, parse_qs(url.query))
+        else:
+            status, content_type, body = self.fault(fault)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _serve(handler: type, throttled: Iterable[int] = (), errors: Iterable[int] = ()) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.faults = dict([(n, 'throttled') for n in throttled] + [(n, 'error') for n in errors])
+    server.injected = Counter()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def server_url(server: ThreadingHTTPServer) -> str:
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def rightmove_server(latency: float = 0.05, result_count: int = 1000, search_type: str = 'rent',
+                     throttled: Iterable[int] = (), errors: Iterable[int] = ()) -> ThreadingHTTPServer:
+    """serves result pages for a search with result_count properties and a detail page for each of them, answering
+    the requests numbered in throttled and errors with a 429 and a 503
+
+    the minPrice, maxPrice, minBedrooms and maxBedrooms search filters are applied, but (unlike rightmove) there's no
+    limit on how far into the results index can go. search at server_url(server) + search_url(search_type), stop with
+    server.shutdown()
+    """
+    listings = [(pid, listing_price(pid, search_type), listing_beds(pid))
+                for pid in range(60000000, 60000000 + result_count)]
+
+    @lru_cache(maxsize=None)
+    def matching(min_price: float, max_price: float, min_beds: int, max_beds: int) -> list:
+        return [pid for pid, price, beds in listings
+                if min_price <= price <= max_price and min_beds <= beds <= max_beds]
+
+    @lru_cache(maxsize=4096)
+    def results(filters: tuple, index: int) -> bytes:
+        ids = matching(*filters)
+        return results_page(ids[index:index + RESULTS_PER_PAGE], len(ids), search_type).encode('utf-8')
+
+    class Handler(_Handler):
+        def body(self, path, query):
+            detail = re.search(r'/property-(\d+)\.html', path)
+            if detail:
+                return 'text/html; charset=utf-8', detail_page(int(detail.group(1))).encode('utf-8')
+            param = lambda name, default: query.get(name, [default])[0] or default
+            filters = (float(param('minPrice', 0)), float(param('maxPrice', 'inf')), int(param('minBedrooms', 0)),
+                       int(param('maxBedrooms', 100)))
+            return 'text/html; charset=utf-8', results(filters, int(param('index', 0)))
+
+    Handler.latency = latency
+    return _serve(Handler, throttled, errors)
+
+
+def search_url(search_type: str = 'rent') -> str:
+    return f'{SEARCH_PATHS[search_type]}/find.html?locationIdentifier=STATION%5E5792&radius=1.0'
+
+
+def _stub_minutes(origin: tuple, destination: tuple) -> int:
+    """a journey time that grows with distance at about 4 minutes a km, like transit across london"""
+    return int(abs(origin[0] - destination[0]) * 450 + abs(origin[1] - destination[1]) * 280) + 10
+
+
+def distance_matrix_server(latency: float = 0.05, throttled: Iterable[int] = (),
+                           errors: Iterable[int] = ()) -> ThreadingHTTPServer:
+    """answers distance matrix requests (pass server_url(server) as base_url), answering the requests numbered in
+    throttled and errors with OVER_QUERY_LIMIT and UNKNOWN_ERROR as google does, in an otherwise successful response"""
+    class Handler(_Handler):
+        def fault(self, fault):
+            status = 'OVER_QUERY_LIMIT' if fault == 'throttled' else 'UNKNOWN_ERROR'
+            return 200, 'application/json', json.dumps({'status': status, 'rows': []}).encode('utf-8')
+
+        def body(self, path, query):
+            origins = [tuple(map(float, c.split(','))) for c in query['origins'][0].split('|')]
+            destinations = [tuple(map(float, c.split(','))) for c in query['destinations'][0].split('|')]
+            rows = [{'elements': [{'status': 'NOT_FOUND'} if any(math.isnan(v) for v in o + d) else
+                                  {'status': 'OK', 'duration': {'value': _stub_minutes(o, d) * 60}}
+                                  for d in destinations]} for o in origins]
+            return 'application/json', json.dumps({'status': 'OK', 'rows': rows}).encode('utf-8')
+
+    Handler.latency = latency
+    return _serve(Handler, throttled, errors)
@@ -0,0 +1,133 @@
+"""the request scheduler against stand in servers that throttle and fail chosen requests, checking that every fault is
+retried, that the rate backs off when throttled and recovers once requests succeed again and that the quota tallies
+match the requests the servers saw
+
+run from the repo root: python -m benchmarks.throttling
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from homing_in.fetcher import Fetcher
+from homing_in.scheduler import RequestScheduler
+from homing_in.travel_time import travel_times
+from benchmarks.crawl import TARGETS
+from benchmarks.servers import distance_matrix_server, rightmove_server, server_url
+
+RATE = 50  # requests per second allowed to the stand ins
+THROTTLED = range(21, 24)  # three in a row, so one request is throttled three times and the rate halves three times
+ERRORS = range(40, 61, 5)
+
+
+def _scheduler(host: str) -> tuple:
+    """a scheduler with short backoffs, and the list the host's rate is added to before each request"""
+    scheduler = RequestScheduler(rates={host: RATE}, backoff=0.01, max_backoff=0.1)
+    bucket = scheduler.bucket(host)
+    acquire, rates = bucket.acquire, []
+
+    def following():
+        rates.append(bucket.rate)
+        acquire()
+
+    bucket.acquire = following
+    return scheduler, rates
+
+
+def _results(scheduler: RequestScheduler, host: str, server, rates: list, calls: int, **settings) -> dict:
+    results = dict(scheduler.quota[host], server_requests=server.requests,
+                   injected_throttled=server.injected['throttled'], injected_errors=server.injected['error'],
+                   lowest_rate=min(rates), final_rate=scheduler.bucket(host).rate, **settings)
+    lowest = rates.index(min(rates))
+    results['requests_to_recover'] = next((i - lowest for i in range(lowest, len(rates)) if rates[i] == RATE), None)
+    results['problems'] = _check(results, calls)
+    return results
+
+
+def _check(results: dict, calls: int) -> list:
+    """the ways results fall short, every fault should cost exactly one retry as none of them run out of retries"""
+    problems = []
+    if results['requests'] != results['server_requests']:
+        problems.append(f'{results["requests"]} requests tallied but the server saw {results["server_requests"]}')
+    if results['retries'] != results['requests'] - calls:
+        problems.append(f'{results["retries"]} retries tallied for {results["requests"]} requests of {calls} calls')
+    if results['retries'] != results['injected_throttled'] + results['injected_errors']:
+        problems.append(f'{results["retries"]} retries for {results["injected_throttled"]} throttled and '
+                        f'{results["injected_errors"]} failed responses')
+    if results['throttled'] != results['injected_throttled']:
+        problems.append(f'{results["throttled"]} throttles tallied but {results["injected_throttled"]} were sent')
+    if results['failed'] > 0:
+        problems.append(f'{results["failed"]} calls failed')
+    if not results['lowest_rate'] < RATE:
+        problems.append('the rate never backed off')
+    if results['final_rate'] != RATE:
+        problems.append(f'the rate only recovered to {results["final_rate"]:.2f} of {RATE}')
+    return problems
+
+
+def measure_fetch(pages: int = 200) -> dict:
+    """fetch pages detail pages one at a time"""
+    server = rightmove_server(0, result_count=pages, throttled=THROTTLED, errors=ERRORS)
+    host = f'127.0.0.1:{server.server_port}'
+    scheduler, rates = _scheduler(host)
+    fetcher = Fetcher(scheduler=scheduler)
+    start = time.perf_counter()
+    try:
+        ok = sum(fetcher.get(f'{server_url(server)}/property-to-rent/property-{pid}.html').status_code == 200
+                 for pid in range(60000000, 60000000 + pages))
+    finally:
+        server.shutdown()
+    results = _results(scheduler, host, server, rates, pages, pages=pages, secs=time.perf_counter() - start)
+    if ok < pages:
+        results['problems'].append(f'only {ok} of {pages} pages fetched')
+    return results
+
+
+def measure_travel(properties: int = 2000, workers: int = 8) -> dict:
+    """travel times with faults injected into the distance matrix responses, compared with a run without"""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'latitude': 51.3 + rng.random(properties) * 0.4,
+                       'longitude': -0.4 + rng.random(properties) * 0.6})
+    clean = distance_matrix_server(0)
+    server = distance_matrix_server(0, throttled=THROTTLED, errors=ERRORS)
+    host = f'127.0.0.1:{server.server_port}'
+    scheduler, rates = _scheduler(host)
+    try:
+        expected = travel_times(df, TARGETS, max_workers=workers, base_url=server_url(clean),
+                                scheduler=RequestScheduler())
+        start = time.perf_counter()
+        found = travel_times(df, TARGETS, max_workers=workers, base_url=server_url(server), scheduler=scheduler)
+        secs = time.perf_counter() - start
+    finally:
+        clean.shutdown()
+        server.shutdown()
+    results = _results(scheduler, host, server, rates, clean.requests, properties=properties, workers=workers,
+                       secs=secs)
+    if not found.equals(expected):
+        results['problems'].append('travel times differ from those of a run without faults')
+    return results
+
+
+def measure(pages: int = 200, properties: int = 2000) -> dict:
+    results = {'fetch': measure_fetch(pages), 'travel': measure_travel(properties)}
+    problems = [f'{name}: {problem}' for name, result in results.items() for problem in result['problems']]
+    assert not problems, 'scheduler misbehaved under throttling: ' + '; '.join(problems)
+    return results
+
+
+def main(pages: int, properties: int):
+    results = measure(pages, properties)
+    for name, result in results.items():
+        print(f'{name}: {result["requests"]} requests ({result["retries"]} retries) for '
+              f'{result["injected_throttled"]} throttled and {result["injected_errors"]} failed responses, rate fell '
+              f'to {result["lowest_rate"]:.2f} and was back to {RATE} {result["requests_to_recover"]} requests later, '
+              f'{result["secs"]:.2f} secs')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--properties', type=int, default=2000)
+    args = parser.parse_args()
+    main(args.pages, args.properties)
@@ -0,0 +1,93 @@
+import logging
+
+from homing_in.fetcher import Fetcher
+from homing_in.metrics import METRICS
+from homing_in.pipeline import Pipeline, search_stage, crawl_stage, travel_stage, score_stage, map_stage
+from homing_in.scorer import Component
+from homing_in.travel_time import Target
+
+logging.basicConfig(
+    format='%(asctime)s.%(msecs)03d - %(name)s:%(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+CANARY_WHARF = (51.50374735798869, -0.01959085464477539)  # canary wharf
+STRAND = (51.51412426735259, 0.11815667152404787)  # strand
+CP = (51.415401341306435, -0.07308483123779297)  # CP
+
+DEPARTURE_TIME_MORN = '2019/07/17 08:00:00'
+DEPARTURE_TIME_EVE = '2019/07/17 18:00:00'
+DEPARTURE_TIME_LATE = '2019/07/19 22:00:00'
+
+TRANSPORT_MODE = 'TRANSIT'
+
+SCORE_MAPPING = {
+    'beds': {
+        '1': -10,
+        '2': 0,
+        '3': 5,
+        '4': 5,
+        'other': -20
+    },
+    'tenure': {
+        'Freehold': 3,
+        'Share of Freehold': 3,
+        'Leasehold': 0,
+        '-': 0,
+        'other': 0
+    },
+    'price': {
+        'max_desired': 650000,
+        'score_per_under': 0.25,
+        'score_per_over': -1.0,
+        'units': 10000
+    },
+    'travel_time': {
+        'ideal_minutes': 25,
+        'bad_minutes': 45,
+        'ideal_score': 10,
+        'over_ideal_cost': - 10/(45-25),
+        'over_bad_cost': - 10/(45-25)*2
+    },
+    'travel_time_2': {
+        'ideal_minutes': 40,
+        'bad_minutes': 55,
+        'ideal_score': 10,
+        'over_ideal_cost': - 10/(55-40),
+        'over_bad_cost': - 10/(55-40)*2
+    }
+}
+
+TARGETS = [
+    Target('travel_time_cw', CANARY_WHARF, DEPARTURE_TIME_MORN, TRANSPORT_MODE),
+    Target('travel_time_from_strand', STRAND, DEPARTURE_TIME_LATE, TRANSPORT_MODE, to_property=True),
+    Target('travel_time_cp', CP, DEPARTURE_TIME_EVE, TRANSPORT_MODE),
+]
+
+COMPONENTS = [
+    Component('bedroom_score', 'beds', 'value_map', 'beds'),
+    Component('tenure_score', 'tenure', 'value_map', 'tenure'),
+    Component('price_score', 'price', 'price', 'price'),
+    Component('tt_score_cw', 'travel_time_cw', 'travel_time', 'travel_time'),
+    Component('tt_score_from_strand', 'travel_time_from_strand', 'travel_time', 'travel_time_2'),
+    Component('tt_score_cp', 'travel_time_cp', 'travel_time', 'travel_time', 0.5),
+]
+
+URL = 'https://www.rightmove.co.uk/property-for-sale/find.html?locationIdentifier=STATION%5E5792&maxBedrooms=3&minBedrooms=2&maxPrice=700000&minPrice=550000&radius=10.0&propertyTypes=&maxDaysSinceAdded=14&includeSSTC=false&mustHave=&dontShow=&furnishTypes=&keywords='
+
+# stages only rerun when their config (or an earlier stage) changes, e.g. editing SCORE_MAPPING reruns score and map
+pipeline = Pipeline([
+    search_stage(URL),
+    crawl_stage(max_pages=42, fetcher=Fetcher(max_workers=8, max_per_host=4)),
+    travel_stage(TARGETS),
+    score_stage(SCORE_MAPPING, COMPONENTS),
+    map_stage('output/reference.csv', 'output/results.html'),
+], cache_dir='output/pipeline_cache')
+pipeline.run()
+
+# where the run's time went (stages, http latency per host, dropped rows, api calls)
+METRICS.save_json('output/run_metrics.json')
+METRICS.save_prometheus('output/homing_in.prom')
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+import logging
+import pickle
+import sqlite3
+import threading
+from typing import Dict, Iterable
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """completed units of long running jobs (result pages, detail pages, travel time lookups) and the units that
+    failed, kept in a sqlite file so a run that stops partway can be restarted without redoing the work it finished
+
+    each job is named by whoever runs it (e.g. the crawler uses its search url) and its units by a string such as
+    'page:3'. a unit that fails is recorded with its error and retried by the next run, and a job is cleared once it
+    finishes without failures, so the next run starts afresh
+
+    :param path: sqlite file to keep the checkpoint in
+    :param max_age: units completed longer ago than this are ignored (and redone), so an old job isn't resumed
+    """
+    _query_chunk = 500
+
+    def __init__(self, path: str, max_age: timedelta = timedelta(days=1)):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()  # shared by the crawlers of a MultiSearchCrawler, which run in threads
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS units (
+            job TEXT, unit TEXT, result BLOB, completed TEXT, PRIMARY KEY (job, unit))""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS failures (
+            job TEXT, unit TEXT, error TEXT, attempts INTEGER, failed TEXT, PRIMARY KEY (job, unit))""")
+        self.conn.commit()
+
+    def done(self, job: str, units: Iterable[str]) -> Dict[str, object]:
+        """unit to result for those of units job has already completed"""
+        units = list(units)
+        oldest = (datetime.today() - self.max_age).isoformat()
+        rows = []
+        with self._lock:
+            for i in range(0, len(units), self._query_chunk):
+                chunk = units[i:i + self._query_chunk]
+                placeholders = ','.join('?' * len(chunk))
+                rows += self.conn.execute(
+                    f'SELECT unit, result FROM units WHERE job = ? AND unit IN ({placeholders}) AND completed >= ?',
+                    [job] + chunk + [oldest]).fetchall()
+        if rows:
+            logger.info(f'checkpoint: resuming {len(rows)} of {len(units)} units of {job}')
+        return {unit: pickle.loads(result) for unit, result in rows}
+
+    def save(self, job: str, unit: str, result):
+        self.save_many(job, {unit: result})
+
+    def save_many(self, job: str, results: Dict[str, object]):
+        """record units of job as completed with their results, clearing any earlier failure"""
+        completed = datetime.today().isoformat()
+        rows = [(job, unit, pickle.dumps(result), completed) for unit, result in results.items()]
+        with self._lock:
+            self.conn.executemany('INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?)', rows)
+            self.conn.executemany('DELETE FROM failures WHERE job = ? AND unit = ?', [row[:2] for row in rows])
+            self.conn.commit()
+
+    def fail(self, job: str, unit: str, error: str):
+        self.fail_many(job, {unit: error})
+
+    def fail_many(self, job: str, errors: Dict[str, str]):
+        """record units of job as failed, counting the attempts"""
+        failed = datetime.today().isoformat()
+        with self._lock:
+            self.conn.executemany(
+                """INSERT INTO failures VALUES (?, ?, ?, 1, ?) ON CONFLICT (job, unit) DO UPDATE SET
+                error = excluded.error, attempts = attempts + 1, failed = excluded.failed""",
+                [(job, unit, error, failed) for unit, error in errors.items()])
+            self.conn.commit()
+
+    def failures(self, job: str = None) -> pd.DataFrame:
+        """the units still failing, of job or of every job"""
+        query = 'SELECT job, unit, error, attempts, failed FROM failures'
+        with self._lock:
+            rows = self.conn.execute(query + ' WHERE job = ?', (job,)).fetchall() if job is not None else \
+                self.conn.execute(query).fetchall()
+        return pd.DataFrame(rows, columns=['job', 'unit', 'error', 'attempts', 'failed'])
+
+    def finish(self, job: str) -> bool:
+        """clear job if none of its units are failing, returning whether it was cleared"""
+        with self._lock:
+            failing = self.conn.execute('SELECT COUNT(*) FROM failures WHERE job = ?', (job,)).fetchone()[0]
+            if failing == 0:
+                self.conn.execute('DELETE FROM units WHERE job = ?', (job,))
+                self.conn.commit()
+        if failing > 0:
+            logger.warning(f'checkpoint: {failing} units of {job} failed, rerun to retry them')
+        return failing == 0
+
+    def clear(self, job: str = None):
+        """forget job (or every job), completed units and failures alike"""
+        with self._lock:
+            for table in ['units', 'failures']:
+                if job is None:
+                    self.conn.execute(f'DELETE FROM {table}')
+                else:
+                    self.conn.execute(f'DELETE FROM {table} WHERE job = ?', (job,))
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -1,25 +1,107 @@
-from datetime import datetime
+from collections import deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from itertools import chain
+import json
 import logging
 import math
 import re
-from typing import Union
+import time
+from typing import Callable, Iterable, Iterator, List, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
-from lxml import html
+from lxml import etree, html
 import pandas as pd
 import requests
 
+from homing_in.checkpoint import Checkpoint
+from homing_in.fetcher import Fetcher
+from homing_in.metrics import METRICS
+from homing_in.property_store import PropertyStore
+from homing_in.records import RecordBuffer
 from homing_in.search_constructor import SearchConstructor, FixedSearch, RightMoveSearch
+from homing_in.stream_parser import Path, extract
 
 logger = logging.getLogger(__name__)
 
+# the values rightmove offers for minPrice / maxPrice, which searches too big to crawl are split along
+PRICE_STEPS = {
+    'sale': [50000, 60000, 70000, 80000, 90000, 100000, 110000, 120000, 125000, 130000, 140000, 150000, 160000,
+             170000, 175000, 180000, 190000, 200000, 210000, 220000, 230000, 240000, 250000, 260000, 270000, 280000,
+             290000, 300000, 325000, 350000, 375000, 400000, 425000, 450000, 475000, 500000, 550000, 600000, 650000,
+             700000, 800000, 900000, 1000000, 1250000, 1500000, 1750000, 2000000, 2500000, 3000000, 4000000,
+             5000000, 7500000, 10000000, 15000000, 20000000],
+    'rent': [100, 150, 200, 250, 300, 350, 400, 450, 500, 600, 700, 800, 900, 1000, 1100, 1200, 1250, 1300, 1400,
+             1500, 1750, 2000, 2250, 2500, 2750, 3000, 3500, 4000, 4500, 5000, 5500, 6000, 6500, 7000, 8000, 9000,
+             10000, 12500, 15000, 17500, 20000, 25000, 30000, 35000, 40000],
+}
+MAX_BEDROOMS = 10
+
+# in place of a page's parsed result when fetching or parsing it failed
+_Failed = namedtuple('_Failed', ['error'])
+
+_parse_crawler = None
+
+
+def _init_parse_worker(crawler):
+    """runs once in each parse worker process, so the crawler is only pickled once per worker"""
+    global _parse_crawler
+    _parse_crawler = crawler
+
+
+def _set_query(url: str, **params) -> str:
+    """url with params added to (or replacing those in) its query string"""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in params and k != 'index']
+    return urlunsplit(parts._replace(query=urlencode(query + [(k, str(v)) for k, v in params.items()])))
+
+
+def _split_search(url: str, search_type: str) -> Union[List[str], None]:
+    """two searches that between them cover url: split in two price bands or, once the band can't be split any
+    further, in two bedroom ranges. None when neither can be split
+
+    rightmove's price bands include both ends, so a property priced exactly on the split is found by both searches
+    """
+    query = dict(parse_qsl(urlsplit(url).query))
+    min_price, max_price = float(query.get('minPrice') or 0), float(query.get('maxPrice') or 'inf')
+    prices = [p for p in PRICE_STEPS[search_type] if min_price < p < max_price]
+    if prices:
+        split = prices[len(prices) // 2]
+        return [_set_query(url, maxPrice=split), _set_query(url, minPrice=split)]
+    min_beds, max_beds = int(query.get('minBedrooms') or 0), int(query.get('maxBedrooms') or MAX_BEDROOMS)
+    if min_beds < max_beds:
+        split = (min_beds + max_beds) // 2
+        return [_set_query(url, minBedrooms=min_beds, maxBedrooms=split),
+                _set_query(url, minBedrooms=split + 1, maxBedrooms=max_beds)]
+    return None
+
+
+def _timed(parse: Callable, request_content) -> tuple:
+    start = time.perf_counter()
+    try:
+        result = parse(request_content)
+    except Exception as e:  # one page rightmove laid out differently shouldn't stop the whole crawl
+        result = _Failed(f'{type(e).__name__}: {e}')
+    return result, time.perf_counter() - start
+
+
+def _parse_page_in_worker(request_content):
+    """the parsed page and the seconds spent parsing it, so the parse time can be recorded in the main process"""
+    return _timed(_parse_crawler._parse_results_page, request_content)
+
+
+def _parse_property_in_worker(request_content):
+    return _timed(_parse_crawler._scrape_property, request_content)
+
 
 class Crawler:
     def __init__(self, search: SearchConstructor):
         self.search = search
 
-    def create(self):
+    def create(self, **kwargs):
         if 'rightmove' in self.search.response.url:
-            return RightMoveCrawler(self.search)
+            return RightMoveCrawler(self.search, **kwargs)
 
     @staticmethod
     def _strip_non_alpha_numeric(dirty_list: list) -> list:
@@ -32,8 +114,94 @@ class Crawler:
 
 
 class RightMoveCrawler(Crawler):
-    def __init__(self, search: Union[FixedSearch, RightMoveSearch]):
+    base_url = 'http://www.rightmove.co.uk'
+    results_per_page = 24
+    page_limit = 42  # rightmove won't page any further into a search
+    extraction_modes = ['document', 'cards']
+    shallow_modes = ['beds', 'latitude', 'longitude', 'tenure']
+    detail_parsers = ['tree', 'stream']
+    # column types (see RecordBuffer) of the listings read from result pages and the fields read from detail pages
+    listing_schema = {'price': 'int', 'description': 'str', 'address': 'str', 'url': 'str', 'agent_url': 'str',
+                      'id': 'str', 'scrape_time': 'datetime'}
+    detail_schema = {'beds': 'str', 'tenure': 'str', 'latitude': 'str', 'longitude': 'str'}
+    _json_model_re = re.compile(rb'window\.jsonModel\s*=\s*')
+
+    # compiled once and evaluated relative to each property card by _scrape_cards, the field values are plain strings
+    # as nothing needs their parent element
+    _card_xp = etree.XPath('//div[contains(concat(" ", normalize-space(@class), " "), " propertyCard ")]')
+    _card_field_xps = {
+        'price_rent': etree.XPath('.//span[@class="propertyCard-priceValue"]/text()', smart_strings=False),
+        'price_buy': etree.XPath('.//div[@class="propertyCard-priceValue"]/text()', smart_strings=False),
+        'description': etree.XPath('.//div[@class="propertyCard-details"]//a[@class="propertyCard-link"]'
+                                   '//h2[@class="propertyCard-title"]/text()', smart_strings=False),
+        'address': etree.XPath('.//address[@class="propertyCard-address"]//span/text()', smart_strings=False),
+        'url': etree.XPath('.//div[@class="propertyCard-details"]//a[@class="propertyCard-link"]/@href',
+                           smart_strings=False),
+        'agent_url': etree.XPath('.//div[@class="propertyCard-contactsItem"]//div[@class="propertyCard-branchLogo"]'
+                                 '//a[@class="propertyCard-branchLogo-link"]/@href', smart_strings=False),
+    }
+
+    # the detail page xpaths of _get_property_beds, _get_property_tenure and _get_property_coords, for the stream parser
+    _detail_paths = {
+        'beds': Path('primaryContent', False, [('div', 1), ('div', None), ('div', None), ('div', 2), ('div', None),
+                                               ('h1', None)], 'text'),
+        'tenure': Path('tenureType', False, [], 'text'),
+        'coords_buy': Path('description', False, [('div', None), ('div', 2), ('div', 2), ('div', None), ('a', None),
+                                                  ('img', None)], 'src'),
+        'coords_rent': Path('description', True, [('div', None), ('div', 2), ('div', 1), ('div', None), ('a', None),
+                                                  ('img', None)], 'src'),
+    }
+
+    def __init__(self, search: Union[FixedSearch, RightMoveSearch], fetcher: Fetcher = None,
+                 parse_workers: int = 0, store: PropertyStore = None, max_detail_age: timedelta = timedelta(days=7),
+                 extraction: str = 'document', shard: bool = True, shallow_fields: Iterable[str] = (),
+                 detail_parser: str = 'tree', checkpoint: Checkpoint = None, base_url: str = None):
+        """
+
+        :param search: search that has already been run
+        :param fetcher: used for result and detail pages, pass e.g. Fetcher(max_workers=8, max_per_host=4) to fetch
+            concurrently (defaults to fetching one page at a time)
+        :param parse_workers: number of processes to parse pages in while the next pages download (0 parses on the
+            calling thread)
+        :param store: property details already scraped, detail pages are only fetched for properties missing from
+            the store or scraped more than max_detail_age ago
+        :param max_detail_age: how long stored property details are reused for
+        :param extraction: how result pages are read, 'document' runs each xpath over the whole page and zips the
+            results together, 'cards' reads every field relative to its own property card so a card missing a field
+            gets a null instead of shifting the following cards. 'cards' is for correctness rather than speed, it parses
+            a page in about the same time as 'document' (see benchmarks/parsing.py)
+        :param shard: when the search has more properties than rightmove will page through (42 pages of 24), scrape
+            splits it into smaller price band (then bedroom) searches and crawls those in parallel instead
+        :param shallow_fields: property details to read from the data rightmove embeds in each result page rather
+            than from detail pages: any of beds, latitude and longitude, plus tenure which the result pages don't
+            have, so it is '-' (listing every field skips detail pages altogether, one request per result page).
+            detail pages are still fetched for the other fields, and for properties missing a shallow field
+        :param detail_parser: how detail pages are read, 'tree' parses the whole page and runs xpaths over it,
+            'stream' follows the same paths through the page as it is parsed, without building a tree, and stops as
+            soon as they have all been found
+        :param checkpoint: record each result and detail page as it is done, so a crawl of the same search restarted
+            after a crash carries on where it stopped. pages that fail to download or parse are recorded there (and
+            skipped) rather than stopping the crawl, and are retried by the next run
+        :param base_url: host the result page links are relative to (defaults to rightmove's), e.g. a local stand in
+        """
+        assert extraction in self.extraction_modes, \
+            f'extraction must be one of {self.extraction_modes} (chosen: {extraction})'
+        assert set(shallow_fields) <= set(self.shallow_modes), \
+            f'shallow_fields must be some of {self.shallow_modes} (chosen: {shallow_fields})'
+        assert detail_parser in self.detail_parsers, \
+            f'detail_parser must be one of {self.detail_parsers} (chosen: {detail_parser})'
         super().__init__(search)
+        self.fetcher = fetcher or Fetcher()
+        self.parse_workers = parse_workers
+        self.store = store
+        self.max_detail_age = max_detail_age
+        self.extraction = extraction
+        self.shard = shard
+        self.shallow_fields = [f for f in self.shallow_modes if f in shallow_fields]
+        self.detail_parser = detail_parser
+        self.checkpoint = checkpoint
+        if base_url is not None:
+            self.base_url = base_url
         self.property_count = self._count_properties()
         self.page_count = self._page_count()
 
@@ -45,10 +213,13 @@ class RightMoveCrawler(Crawler):
 
     def _page_count(self) -> int:
         """number of pages to search through"""
-        max_results_per_page = 24
-        max_pages = 42
-        cnt = math.ceil(self.property_count / max_results_per_page)
-        return int(min([cnt, max_pages]))
+        cnt = math.ceil(self.property_count / self.results_per_page)
+        return int(min([cnt, self.page_limit]))
+
+    @property
+    def truncated(self) -> bool:
+        """whether the search has more properties than rightmove will page through"""
+        return self.property_count > self.page_limit * self.results_per_page
 
     def _get_prices(self, html_tree) -> list:
         if self.search.search_type == 'rent':
@@ -104,11 +275,13 @@ class RightMoveCrawler(Crawler):
             xp = "//*[@id='description']/div/div[2]/div[1]/div/a/img"
         map_resp = html_tree.xpath(xp)
         if len(map_resp) > 0:
-            map_source = map_resp[0].attrib['src']
-            lat = map_source.split('latitude=')[1].split('&')[0]
-            long = map_source.split('longitude=')[1].split('&')[0]
-        else:
-            lat, long = None, None
+            return self._map_coords(map_resp[0].attrib['src'])
+        return None, None
+
+    @staticmethod
+    def _map_coords(map_source: str) -> tuple:
+        lat = map_source.split('latitude=')[1].split('&')[0]
+        long = map_source.split('longitude=')[1].split('&')[0]
         return lat, long
 
     @staticmethod
@@ -119,10 +292,8 @@ class RightMoveCrawler(Crawler):
             tenure = '-'
         return tenure
 
-    @staticmethod
-    def _append_url(append_list: list) -> list:
-        base = 'http://www.rightmove.co.uk'
-        return [f'{base}{x}' for x in append_list]
+    def _append_url(self, append_list: list) -> list:
+        return [f'{self.base_url}{x}' for x in append_list]
 
     @staticmethod
     def _rental_price_convert(price):
@@ -135,22 +306,33 @@ class RightMoveCrawler(Crawler):
             logger.warning(f'PRICE: {price}')
         return out
 
-    def _scrape_to_df(self, prices: list, titles: list, addresses: list, weblinks: list,
-                      agent_urls: list, ids: list) -> pd.DataFrame:
+    def _listing_columns(self, prices: list, titles: list, addresses: list, weblinks: list,
+                         agent_urls: list, ids: list) -> tuple:
+        """the listings as columns, and the number of rows dropped for each reason
 
-        df_len = min([len(ids), len(prices), len(titles), len(addresses), len(weblinks), len(agent_urls)]) # there can be blank cards for some of the fields
-        df = pd.DataFrame({'price': prices[:df_len], 'description': titles[:df_len], 'address': addresses[:df_len],
-                           'url': weblinks[:df_len], 'agent_url': agent_urls[:df_len], 'id': ids[:df_len]})
-        df.dropna(inplace=True)
-        if self.search.search_type == 'rent':
-            df['price'] = df['price'].map(lambda x: self._rental_price_convert(x))
-        # df = df[df['price'].apply(lambda x: x.isnumeric())]  # drop non numeric
-        if len(df) > 0:
-            df['price'] = df['price'].astype(int)
-            df['scrape_time'] = datetime.today()
+        the counts are returned with the page (rather than counted here) so they survive parsing in a worker process
+        """
+        lens = [len(ids), len(prices), len(titles), len(addresses), len(weblinks), len(agent_urls)]
+        n_rows = min(lens)  # there can be blank cards for some of the fields
+        rows = zip([None if x is None else self._int_price(x) for x in prices[:n_rows]], titles[:n_rows],
+                   addresses[:n_rows], weblinks[:n_rows], agent_urls[:n_rows], ids[:n_rows])
+        complete = [row for row in rows if None not in row]  # a price that isn't a number counts as missing
+        prices, titles, addresses, weblinks, agent_urls, ids = map(list, zip(*complete)) if complete else [[]] * 6
+        columns = {'price': prices, 'description': titles, 'address': addresses, 'url': weblinks,
+                   'agent_url': agent_urls, 'id': ids, 'scrape_time': datetime.today()}
+        return columns, {'truncated': max(lens) - n_rows, 'missing_values': n_rows - len(complete)}
+
+    def _page_frame(self, columns: dict, rows_dropped: dict) -> pd.DataFrame:
+        records = RecordBuffer(self._listing_schema(), key=None)
+        records.extend(columns)
+        df = records.to_frame()
+        df.attrs['rows_dropped'] = rows_dropped
         return df
 
     def _scrape_page(self, request_content) -> pd.DataFrame:
+        return self._page_frame(*self._page_columns(request_content))
+
+    def _page_columns(self, request_content) -> tuple:
         # process html
         tree = html.fromstring(request_content)
 
@@ -162,56 +344,446 @@ class RightMoveCrawler(Crawler):
         agent_urls = self._get_agent_urls(tree)
         ids = self._get_id(urls)
 
-        page_df = self._scrape_to_df(prices, titles, addresses, urls, agent_urls, ids)
-        return page_df
+        return self._listing_columns(prices, titles, addresses, urls, agent_urls, ids)
+
+    def _int_price(self, price: str) -> Union[int, None]:
+        """a cleaned price (monthly for rentals), None if it isn't a number, e.g. 'POA'"""
+        try:
+            return int(self._rental_price_convert(price) if self.search.search_type == 'rent' else price)
+        except ValueError:
+            logger.warning(f'PRICE: {price}')
+            return None
+
+    def _scrape_cards(self, request_content) -> pd.DataFrame:
+        return self._page_frame(*self._card_columns(request_content))
+
+    def _card_columns(self, request_content) -> tuple:
+        """one record per property card, with None for any field the card doesn't have
+
+        each card's first match of each field is collected, then the fields are cleaned a column at a time as
+        _page_columns does, rather than card by card
+        """
+        tree = html.fromstring(request_content)
+        xps = self._card_field_xps
+        fields = {'price': xps['price_rent' if self.search.search_type == 'rent' else 'price_buy'],
+                  'description': xps['description'], 'address': xps['address'], 'agent_url': xps['agent_url']}
+        found = {'url': [], **{name: [] for name in fields}}
+        no_link = 0
+        for card in self._card_xp(tree):
+            links = xps['url'](card)
+            if not links or links[0] == '':  # blank or template cards have no link to a property
+                no_link += 1
+                continue
+            found['url'].append(links[0])
+            for name, xp in fields.items():
+                values = xp(card)
+                found[name].append(values[0] if values else None)
+        prices = self._present(found['price'], lambda x: self._strip_non_alpha_numeric(self._strip_whitespace(x)))
+        urls = self._append_url(found['url'])
+        columns = {'price': [None if x is None else self._int_price(x) for x in prices],
+                   'description': self._present(found['description'], self._strip_whitespace),
+                   'address': found['address'], 'url': urls,
+                   'agent_url': self._present(found['agent_url'], self._append_url), 'id': self._get_id(urls),
+                   'scrape_time': datetime.today()}
+        return columns, {'no_property_link': no_link}
+
+    @staticmethod
+    def _present(values: list, clean: Callable[[list], list]) -> list:
+        """values with clean applied to those that aren't None"""
+        cleaned = iter(clean([x for x in values if x is not None]))
+        return [None if x is None else next(cleaned) for x in values]
+
+    def _json_model_properties(self, request_content) -> dict:
+        """property id to beds, latitude and longitude from the window.jsonModel embedded in a result page"""
+        content = request_content if isinstance(request_content, bytes) else request_content.encode('utf-8')
+        found = self._json_model_re.search(content)
+        if found is None:
+            logger.warning('no jsonModel found in the result page')
+            return {}
+        model, _ = json.JSONDecoder().raw_decode(content[found.end():].decode('utf-8', errors='replace'))
+        properties = {}
+        for prop in model.get('properties', []):
+            location = prop.get('location') or {}
+            properties[str(prop['id'])] = {
+                'beds': None if prop.get('bedrooms') is None else str(prop['bedrooms']),
+                'latitude': None if location.get('latitude') is None else str(location['latitude']),
+                'longitude': None if location.get('longitude') is None else str(location['longitude']),
+                'tenure': '-',
+            }
+        return properties
+
+    def _add_shallow_fields(self, columns: dict, request_content):
+        properties = self._json_model_properties(request_content)
+        for field in self.shallow_fields:
+            columns[field] = [properties.get(pid, {}).get(field) for pid in columns['id']]
+
+    def _parse_results_page(self, request_content) -> tuple:
+        """the listings on a result page as columns, and the rows dropped for each reason"""
+        if self.extraction == 'cards':
+            columns, rows_dropped = self._card_columns(request_content)
+        else:
+            columns, rows_dropped = self._page_columns(request_content)
+        if self.shallow_fields:
+            self._add_shallow_fields(columns, request_content)
+        return columns, rows_dropped
+
+    def _listing_schema(self) -> dict:
+        if self.extraction == 'cards':  # a card can be missing its price
+            return dict(self.listing_schema, price='Int64')
+        return dict(self.listing_schema)
+
+    def _record_schema(self, details: bool = False) -> dict:
+        """schema of a crawl's records: the listings, with any shallow fields, and (with details) the rest of the
+        detail page fields"""
+        schema = self._listing_schema()
+        schema.update((field, self.detail_schema[field]) for field in self.shallow_fields)
+        schema['page_number'] = 'int'
+        if details:
+            schema.update((field, kind) for field, kind in self.detail_schema.items() if field not in schema)
+        return schema
 
     def _get_id(self, urls: list) -> list:
-        return [x.split('property-')[2].split('.html')[0] for x in urls if x != 'http://www.rightmove.co.uk']
+        return [x.split('property-')[2].split('.html')[0] for x in urls if x != self.base_url]
 
     def _scrape_property(self, request_content) -> dict:
+        if self.detail_parser == 'stream':
+            return self._stream_property(request_content)
+        return self._parse_property(request_content)
+
+    def _parse_property(self, request_content) -> dict:
         tree = html.fromstring(request_content)
         beds = self._get_property_beds(tree)
         tenure = self._get_property_tenure(tree)
         lat, long = self._get_property_coords(tree)
         return {'beds': beds, 'tenure': tenure, 'latitude': lat, 'longitude': long}
 
-    def _scrape_properties(self, results_df: pd.DataFrame) -> pd.DataFrame:
-        prop_dicts = []
-        for property_id, url in zip(results_df['id'], results_df['url']):
-            logger.debug(f'property url: {url}')
-            property_page = requests.get(url)
-            prop_details = self._scrape_property(property_page.content)
-            prop_details['id'] = property_id
-            prop_dicts.append(prop_details)
-        property_details = pd.DataFrame(prop_dicts)
-        return property_details
+    def _stream_property(self, request_content) -> dict:
+        """same as _parse_property, without building a tree of the page"""
+        coords = 'coords_buy' if self.search.search_type == 'buy' else 'coords_rent'
+        found = extract(request_content, {'beds': self._detail_paths['beds'],
+                                          'tenure': self._detail_paths['tenure'],
+                                          'coords': self._detail_paths[coords]})
+        descr = found['beds'][0] if found['beds'] else '-'
+        beds = descr.split()[0] if descr != '-' else descr
+        tenure = found['tenure'][0] if found['tenure'] else '-'
+        lat, long = self._map_coords(found['coords'][0]) if found['coords'] else (None, None)
+        return {'beds': beds, 'tenure': tenure, 'latitude': lat, 'longitude': long}
+
+    def __getstate__(self):
+        """parse workers only need the search and base url, not the fetcher's session or locks"""
+        state = self.__dict__.copy()
+        state['fetcher'] = None
+        state['store'] = None
+        state['checkpoint'] = None
+        state['base_url'] = self.base_url
+        return state
+
+    def _options(self) -> dict:
+        """the settings this crawler was made with, for the crawlers of the smaller searches it is sharded into"""
+        return {'parse_workers': self.parse_workers, 'store': self.store, 'max_detail_age': self.max_detail_age,
+                'extraction': self.extraction, 'shallow_fields': self.shallow_fields,
+                'detail_parser': self.detail_parser, 'checkpoint': self.checkpoint, 'base_url': self.base_url}
+
+    def _parse_pool(self) -> Union[ProcessPoolExecutor, nullcontext]:
+        """use as `with self._parse_pool() as pool`, pool is None without parse workers"""
+        if self.parse_workers > 0:
+            return ProcessPoolExecutor(self.parse_workers, initializer=_init_parse_worker, initargs=(self,))
+        return nullcontext()
 
     @staticmethod
-    def _construct_index(page_number: int):
-        """index appears to be the count of the final result on the page e.g. 24 on first page = 24, 24 on second = 48
-        3 on third page = 51
+    def _parsed(stage: str, timed_result: tuple):
+        result, seconds = timed_result
+        METRICS.add_time(stage, seconds)
+        return result
+
+    @property
+    def _job(self) -> str:
+        """the crawl's name in the checkpoint"""
+        return f'crawl:{self.search.response.url}'
+
+    def _resumed(self, units: List[str]) -> dict:
+        return self.checkpoint.done(self._job, units) if self.checkpoint is not None else {}
+
+    def _completed(self, unit: str, result):
+        """record unit as done, or as failed when result is _Failed"""
+        if isinstance(result, _Failed):
+            logger.warning(f'{unit} failed and is skipped: {result.error}')
+            METRICS.count('units_failed', unit=unit.split(':')[0])
+            if self.checkpoint is not None:
+                self.checkpoint.fail(self._job, unit, result.error)
+        elif self.checkpoint is not None:
+            self.checkpoint.save(self._job, unit, result)
+
+    def _finish(self):
+        if self.checkpoint is not None:
+            self.checkpoint.finish(self._job)
+
+    def _fetch_and_parse(self, urls: Iterable[str], parse: Callable, parse_in_worker: Callable,
+                         pool: ProcessPoolExecutor = None, stage: str = 'parse') -> list:
+        """fetch and parse each url, returning the parsed results in url order
+
+        with a pool, each page is queued for parsing as soon as it arrives while later pages are still downloading.
+        the time spent parsing is recorded as stage
+        """
+        if pool is None:
+            return [self._parsed(stage, self._parse_response(parse, resp))
+                    for resp in self.fetcher.get_many(urls, return_exceptions=True)]
+        return list(self._iter_parsed(self.fetcher.iter_many(urls, return_exceptions=True), parse, parse_in_worker,
+                                      pool, stage))
 
+    @staticmethod
+    def _parse_response(parse: Callable, resp: Union[requests.Response, Exception]) -> tuple:
+        if isinstance(resp, Exception):
+            return _Failed(f'{type(resp).__name__}: {resp}'), 0.0
+        if resp.status_code != 200:  # an error page, not the page asked for
+            return _Failed(f'status {resp.status_code}: {resp.url}'), 0.0
+        return _timed(parse, resp.content)
+
+    def _iter_parsed(self, responses: Iterable[requests.Response], parse: Callable, parse_in_worker: Callable,
+                     pool: ProcessPoolExecutor = None, stage: str = 'parse') -> Iterator:
+        """as _fetch_and_parse, but yielding each parsed result (in order) as soon as it is ready
+
+        a response that is an exception (it couldn't be fetched) or not a 200, or a page that can't be parsed, gives a
+        _Failed
         """
-        results_per_page = 24
-        return page_number * results_per_page
+        if pool is None:
+            for resp in responses:
+                yield self._parsed(stage, self._parse_response(parse, resp))
+            return
+        parsing = deque()
+        for resp in responses:
+            if isinstance(resp, Exception) or resp.status_code != 200:
+                failed = Future()
+                failed.set_result(self._parse_response(parse, resp))
+                parsing.append(failed)
+            else:
+                parsing.append(pool.submit(parse_in_worker, resp.content))
+            while parsing and parsing[0].done():
+                yield self._parsed(stage, parsing.popleft().result())
+        while parsing:
+            yield self._parsed(stage, parsing.popleft().result())
+
+    def _fill_details(self, records: RecordBuffer, ids: List[str], pool: ProcessPoolExecutor = None):
+        """fill in the detail page fields of records for ids, keeping any already read from the result pages"""
+        if len(self.shallow_fields) == len(self.shallow_modes):
+            # every detail comes from the result pages, detail pages are only needed where one lacked a field
+            needed = [pid for pid in ids if records.missing(pid, self.shallow_fields)]
+            METRICS.count('detail_pages_skipped', len(ids) - len(needed))
+            ids = needed
+        for property_id, prop_details in self._iter_details(ids, [records.get(pid, 'url') for pid in ids], pool):
+            records.fill(property_id, prop_details)
+
+    def _iter_details(self, ids: List[str], urls: List[str], pool: ProcessPoolExecutor = None) -> Iterator[tuple]:
+        """(id, details) for each property, read from the store when it was scraped recently enough, or from the
+        checkpoint when an earlier run of this crawl got to it. properties whose detail page failed are left out"""
+        resumed = self._resumed([f'property:{pid}' for pid in ids])
+        if resumed:
+            yield from ((pid, resumed[f'property:{pid}']) for pid in ids if f'property:{pid}' in resumed)
+            urls = [url for pid, url in zip(ids, urls) if f'property:{pid}' not in resumed]
+            ids = [pid for pid in ids if f'property:{pid}' not in resumed]
+        if self.store is not None:
+            known = self.store.fresh(ids, self.max_detail_age)
+            METRICS.count('properties_from_store', len(known))
+            yield from zip(known['id'], known[self.store.detail_columns].to_dict('records'))
+            known_ids = set(known['id'])
+            urls = [url for pid, url in zip(ids, urls) if pid not in known_ids]
+            ids = [pid for pid in ids if pid not in known_ids]
+        parsed = self._fetch_and_parse(urls, self._scrape_property, _parse_property_in_worker, pool,
+                                       'parse.property_page')
+        fetched = []
+        for pid, details in zip(ids, parsed):
+            self._completed(f'property:{pid}', details)
+            if not isinstance(details, _Failed):
+                fetched.append((pid, details))
+        # only details read from a page rightmove actually served are stored, an error page (a _Failed) never
+        # becomes a record that stops the property's detail page being fetched again for max_detail_age
+        if self.store is not None and len(fetched) > 0:
+            self.store.update(pd.DataFrame([dict(details, id=pid) for pid, details in fetched]))
+        yield from fetched
+
+    def _construct_index(self, page_number: int):
+        """index is the number of results before the page, e.g. 0 on the first page, 24 on the second"""
+        return (page_number - 1) * self.results_per_page
+
+    def _iter_page_columns(self, max_pages: int, pool: ProcessPoolExecutor = None) -> Iterator[dict]:
+        """the listings on each result page as columns, with the page number, in page order"""
+        pages = range(1, min(self.page_count, max_pages) + 1, 1)
+        pg_urls = [f'{self.search.response.url}&index={self._construct_index(pg)}' for pg in pages]
+        logger.info(f'visiting {len(pg_urls)} pages')
+        if self.truncated:
+            logger.warning(f'search has {self.property_count} properties, only the first '
+                           f'{self.page_limit * self.results_per_page} can be crawled: {self.search.response.url}')
+        resumed = self._resumed([f'page:{pg}' for pg in pages])
+        todo = [pg for pg in pages if f'page:{pg}' not in resumed]
+        # the search's own response is the first page, so only the later pages need downloading
+        responses = chain([self.search.response] if 1 in todo else [],
+                          self.fetcher.iter_many([pg_urls[pg - 1] for pg in todo if pg != 1], return_exceptions=True))
+        parsed = self._iter_parsed(responses, self._parse_results_page, _parse_page_in_worker, pool,
+                                   'parse.results_page')
+        for pg in pages:
+            unit = f'page:{pg}'
+            if unit in resumed:
+                page = resumed[unit]
+            else:
+                page = next(parsed)
+                self._completed(unit, page)
+            if isinstance(page, _Failed):
+                continue
+            columns, rows_dropped = page
+            for reason, dropped in rows_dropped.items():
+                METRICS.count('rows_dropped', dropped, reason=reason)
+            columns['page_number'] = pg
+            yield columns
+
+    def _iter_page_records(self, max_pages: int, pool: ProcessPoolExecutor = None,
+                           details: bool = False) -> Iterator[RecordBuffer]:
+        """the listings on each result page, skipping any seen on earlier pages"""
+        seen = set()
+        for columns in self._iter_page_columns(max_pages, pool):
+            records = RecordBuffer(self._record_schema(details), seen=seen)
+            METRICS.count('rows_dropped', len(records.extend(columns)), reason='duplicate')
+            yield records
+
+    def iter_pages(self, max_pages: int = 10) -> Iterator[pd.DataFrame]:
+        """yield the listings on each result page as soon as the page is parsed, skipping any seen on earlier pages"""
+        with self._parse_pool() as pool:
+            for records in self._iter_page_records(max_pages, pool):
+                yield records.to_frame()
+        self._finish()  # only reached once every page is done, not when the caller stops early
+
+    def iter_properties(self, max_pages: int = 10) -> Iterator[pd.DataFrame]:
+        """yield each result page's listings merged with their property details, as soon as that page is done"""
+        with self._parse_pool() as pool:
+            for records in self._iter_page_records(max_pages, pool, details=True):
+                if len(records) == 0:
+                    continue
+                self._fill_details(records, records.keys(), pool)
+                yield records.to_frame()
+        self._finish()
 
     def scrape(self, max_pages: int = 10) -> pd.DataFrame:
-        dfs = []
-        for pg in range(1, min(self.page_count, max_pages) + 1, 1):
-            idx = self._construct_index(pg)
-            pg_url = f'{self.search.response.url}&index={idx}'
-            logger.info(f'visting page {pg}: {pg_url}')
-            pg_resp = requests.get(pg_url)
-            pg_data = self._scrape_page(pg_resp.content)
-            pg_data['page_number'] = pg
-            dfs.append(pg_data)
-            # results[pg] = pg_data
-        results = pd.concat(dfs)
-        results.drop_duplicates(subset=['url'], inplace=True)
-        property_details = self._scrape_properties(results)
-
-        full_results = pd.merge(results, property_details, on='id')
+        if self.shard and self.truncated and max_pages >= self.page_limit:
+            sharded = MultiSearchCrawler([self.search], fetcher=self.fetcher, **self._options())
+            return sharded.scrape(max_pages).drop(columns='searches')
+        # listings and details are collected column by column and only become a DataFrame once, at the end
+        records = RecordBuffer(self._record_schema(details=True))
+        with self._parse_pool() as pool:
+            with METRICS.stage('crawl.result_pages'):
+                for columns in self._iter_page_columns(max_pages, pool):
+                    METRICS.count('rows_dropped', len(records.extend(columns)), reason='duplicate')
+            with METRICS.stage('crawl.detail_pages'):
+                self._fill_details(records, records.keys(), pool)
+        self._finish()
+
+        with METRICS.stage('crawl.to_frame'):
+            full_results = records.to_frame()
         logger.info(f'number of properties scraped: {len(full_results)}')
         return full_results
 
 
+class MultiSearchCrawler:
+    """crawls several searches at once over one shared fetcher, fetching each property's details only once
+
+    listings are merged across searches by property id before any detail page is fetched, and each row is tagged
+    with the searches that found it in a ';' separated searches column. searches with more properties than rightmove
+    will page through are split into smaller price band (then bedroom) searches, recursively, until each fits
+
+    :param urls: rightmove search urls, or searches that have already been run
+    :param labels: name for each search used in the searches column (defaults to the search's position in urls)
+    :param fetcher: shared by every search, e.g. Fetcher(max_workers=8, max_per_host=4)
+    :param shard: split searches too big to crawl in full
+    :param crawler_kwargs: passed on to each RightMoveCrawler
+    """
+    def __init__(self, urls: List[Union[str, FixedSearch]], labels: List[str] = None, fetcher: Fetcher = None,
+                 shard: bool = True, **crawler_kwargs):
+        assert urls, 'at least one search url is needed'
+        self.labels = labels or [str(i) for i in range(len(urls))]
+        assert len(self.labels) == len(urls), 'one label is needed per url'
+        self.fetcher = fetcher or Fetcher()
+        self.crawler_kwargs = crawler_kwargs
+        with ThreadPoolExecutor(max_workers=len(urls)) as pool:
+            crawlers = list(pool.map(self._crawler, urls))
+            shards = list(pool.map(self._shard, crawlers)) if shard else [[crawler] for crawler in crawlers]
+        self.crawlers = [crawler for search_shards in shards for crawler in search_shards]
+        self.crawler_labels = [label for label, search_shards in zip(self.labels, shards) for _ in search_shards]
+
+    def _crawler(self, url: Union[str, FixedSearch]) -> RightMoveCrawler:
+        if isinstance(url, SearchConstructor):
+            search = url
+        else:
+            search = FixedSearch()
+            search.search(url, fetcher=self.fetcher)
+        return RightMoveCrawler(search, fetcher=self.fetcher, shard=False, **self.crawler_kwargs)
+
+    def _shard(self, crawler: RightMoveCrawler) -> List[RightMoveCrawler]:
+        """crawlers that between them cover crawler's search, each small enough to crawl in full"""
+        if not crawler.truncated:
+            return [crawler]
+        urls = _split_search(crawler.search.response.url, crawler.search.search_type)
+        if urls is None:
+            logger.warning(f'search has {crawler.property_count} properties and can\'t be split any further: '
+                           f'{crawler.search.response.url}')
+            return [crawler]
+        logger.info(f'splitting a search of {crawler.property_count} properties: {crawler.search.response.url}')
+        with ThreadPoolExecutor(max_workers=len(urls)) as pool:
+            shards = list(pool.map(self._crawler, urls))
+            return [leaf for leaves in pool.map(self._shard, shards) for leaf in leaves]
+
+    def _crawl_pages(self, crawler: RightMoveCrawler, label: str, max_pages: int) -> List[dict]:
+        with crawler._parse_pool() as pool:
+            pages = list(crawler._iter_page_columns(max_pages, pool))
+        for columns in pages:
+            columns['searches'] = label
+        return pages
+
+    def _scrape_records(self, max_pages: int, details: bool = False) -> RecordBuffer:
+        """listings from every search's result pages, one record per property id"""
+        with METRICS.stage('crawl.result_pages'), ThreadPoolExecutor(max_workers=len(self.crawlers)) as pool:
+            crawled = list(pool.map(self._crawl_pages, self.crawlers, self.crawler_labels,
+                                    [max_pages] * len(self.crawlers)))
+        schema = self.crawlers[0]._record_schema()
+        schema['searches'] = 'str'
+        schema.update(self.crawlers[0]._record_schema(details))
+        records = RecordBuffer(schema)
+        listings, duplicates, across_searches = 0, 0, 0
+        for label, pages in zip(self.crawler_labels, crawled):
+            listed = set()  # by this search, on earlier pages
+            for columns in pages:
+                listings += len(columns['id'])
+                for property_id in records.extend(columns):
+                    if property_id in listed:
+                        duplicates += 1
+                        continue
+                    across_searches += 1
+                    searches = records.get(property_id, 'searches')
+                    if label not in searches.split(';'):
+                        records.set(property_id, 'searches', f'{searches};{label}')
+                listed.update(columns['id'])
+        METRICS.count('rows_dropped', duplicates, reason='duplicate')
+        METRICS.count('rows_dropped', across_searches, reason='duplicate_across_searches')
+        logger.info(f'{listings} listings from {len(crawled)} searches, {len(records)} unique')
+        return records
+
+    def scrape_cards(self, max_pages: int = 10) -> pd.DataFrame:
+        """listings from every search's result pages, one row per property id"""
+        return self._scrape_records(max_pages).to_frame()
+
+    def scrape(self, max_pages: int = 10) -> pd.DataFrame:
+        records = self._scrape_records(max_pages, details=True)
+        # detail pages are laid out by search type, so each property is read by the first crawler that found it
+        by_search = {}
+        for property_id in records.keys():
+            by_search.setdefault(records.get(property_id, 'searches').split(';')[0], []).append(property_id)
+        crawlers = {}
+        for crawler, label in zip(self.crawlers, self.crawler_labels):
+            crawlers.setdefault(label, crawler)
+        with METRICS.stage('crawl.detail_pages'):
+            for label, ids in by_search.items():
+                with crawlers[label]._parse_pool() as pool:
+                    crawlers[label]._fill_details(records, ids, pool)
+        for crawler in self.crawlers:
+            crawler._finish()
+        with METRICS.stage('crawl.to_frame'):
+            full_results = records.to_frame()
+        logger.info(f'number of properties scraped: {len(full_results)}')
+        return full_results
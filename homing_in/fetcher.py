@@ -0,0 +1,114 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+from typing import Iterable, Iterator, List, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from homing_in.http_cache import HttpCache
+from homing_in.metrics import METRICS
+from homing_in.scheduler import RequestScheduler, SCHEDULER
+
+logger = logging.getLogger(__name__)
+
+
+class Fetcher:
+    """fetches pages over a pooled keep-alive session, optionally with several requests in flight at once
+
+    :param max_workers: number of requests allowed in flight at once (1 fetches sequentially)
+    :param max_per_host: politeness limit on concurrent requests to any single host (None for no extra limit)
+    :param timeout: seconds to wait for a response
+    :param cache: serve responses from, and store them in, this on-disk cache
+    :param scheduler: rate limits and retries every download (defaults to the shared scheduler)
+    """
+    def __init__(self, max_workers: int = 1, max_per_host: int = None, timeout: float = 30, cache: HttpCache = None,
+                 scheduler: RequestScheduler = None):
+        assert max_workers >= 1, 'max_workers must be at least 1'
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host or max_workers
+        self.timeout = timeout
+        self.cache = cache
+        self.scheduler = scheduler or SCHEDULER
+        self.session = self._create_session()
+        self._host_limits = {}
+        self._host_lock = threading.Lock()
+
+    def _create_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _host_limit(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._host_lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_limits[host]
+
+    def get(self, url: str) -> requests.Response:
+        """the response for url, raising requests.HTTPError if it is still throttled (429) or failing (5xx) once the
+        scheduler's retries run out"""
+        if self.cache is not None:
+            return self.cache.get(url, lambda headers: self._download(url, headers))
+        return self._download(url)
+
+    @staticmethod
+    def _retry_reason(response: requests.Response):
+        if response.status_code == 429:
+            return 'throttled'
+        if response.status_code >= 500:
+            return f'server error {response.status_code}'
+        return None
+
+    @staticmethod
+    def _retryable(error: Exception):
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            return type(error).__name__
+        return None
+
+    def _download(self, url: str, headers: dict = None) -> requests.Response:
+        host = urlsplit(url).netloc
+
+        def request():
+            with self._host_limit(url):
+                logger.debug(f'fetching: {url}')
+                start = time.perf_counter()
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+                METRICS.observe_request(host, time.perf_counter() - start, len(response.content))
+                return response
+        response = self.scheduler.call(host, request, self._retry_reason, self._retryable)
+        if self._retry_reason(response) is not None:  # still throttled or failing once the retries ran out
+            response.raise_for_status()
+        return response
+
+    def _get_or_error(self, url: str) -> Union[requests.Response, Exception]:
+        try:
+            return self.get(url)
+        except Exception as e:
+            logger.warning(f'failed to fetch {url}: {e}')
+            return e
+
+    def get_many(self, urls: Iterable[str], return_exceptions: bool = False) -> List[requests.Response]:
+        """fetch all urls, returning the responses in the same order as the urls
+
+        :param return_exceptions: return the exception in place of the response for a url that couldn't be fetched,
+            rather than raising it
+        """
+        urls = list(urls)
+        if self.max_workers == 1 or len(urls) <= 1:
+            get = self._get_or_error if return_exceptions else self.get
+            return [get(url) for url in urls]
+        return list(self.iter_many(urls, return_exceptions))
+
+    def iter_many(self, urls: Iterable[str], return_exceptions: bool = False) -> Iterator[requests.Response]:
+        """yield responses in url order as they arrive, with later urls downloading in the background meanwhile"""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            yield from pool.map(self._get_or_error if return_exceptions else self.get, urls)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,145 @@
+from datetime import timedelta
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict
+import zlib
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger(__name__)
+
+# rightmove result pages change through the day, listings themselves rarely do
+DEFAULT_TTLS = {
+    r'/find\.html': timedelta(hours=1),
+    r'/property-\d+\.html': timedelta(days=7),
+}
+
+
+class HttpCache:
+    """on-disk cache of response bodies, keyed by url and stored zlib compressed in a sqlite file
+
+    expired entries are revalidated with If-None-Match / If-Modified-Since when the server sent an ETag or
+    Last-Modified header. once the compressed bodies exceed max_bytes the least recently used entries are evicted
+
+    :param path: sqlite file to store responses in
+    :param max_bytes: upper bound on the total size of the compressed bodies
+    :param ttls: regex pattern to time to live, the first pattern found in a url sets its ttl
+    :param default_ttl: time to live for urls that don't match any pattern in ttls
+    """
+    _kept_headers = ['Content-Type', 'ETag', 'Last-Modified']
+
+    def __init__(self, path: str, max_bytes: int = 500 * 1024 ** 2, ttls: Dict[str, timedelta] = None,
+                 default_ttl: timedelta = timedelta(hours=12)):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in (DEFAULT_TTLS if ttls is None else ttls).items()]
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY, final_url TEXT, headers TEXT, body BLOB, size INTEGER, stored_at REAL,
+            last_access REAL)""")
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+        self.conn.commit()
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def ttl(self, url: str) -> timedelta:
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return self.default_ttl
+
+    def get(self, url: str, fetch: Callable[[dict], requests.Response]) -> requests.Response:
+        """cached response for url, calling fetch(headers) to download it when missing or stale
+
+        :param url: url to look up
+        :param fetch: makes the request for url with the extra request headers passed to it
+        """
+        with self._lock:
+            row = self.conn.execute('SELECT final_url, headers, body, stored_at FROM responses WHERE url = ?',
+                                    (url,)).fetchone()
+        if row is not None:
+            final_url, headers, body, stored_at = row
+            headers = json.loads(headers)
+            if time.time() - stored_at < self.ttl(url).total_seconds():
+                self.hits += 1
+                self._touch(url)
+                return self._build_response(final_url, headers, body)
+            conditional = {}
+            if 'ETag' in headers:
+                conditional['If-None-Match'] = headers['ETag']
+            if 'Last-Modified' in headers:
+                conditional['If-Modified-Since'] = headers['Last-Modified']
+            if conditional:
+                response = fetch(conditional)
+                if response.status_code == 304:
+                    logger.debug(f'cache revalidated: {url}')
+                    self.revalidations += 1
+                    self._touch(url, refreshed=True)
+                    return self._build_response(final_url, headers, body)
+                self.misses += 1
+                self._store(url, response)
+                return response
+        self.misses += 1
+        response = fetch({})
+        self._store(url, response)
+        return response
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'revalidations': self.revalidations,
+                'evictions': self.evictions, 'bytes': self.total_bytes}
+
+    def _touch(self, url: str, refreshed: bool = False):
+        now = time.time()
+        with self._lock:
+            if refreshed:
+                self.conn.execute('UPDATE responses SET last_access = ?, stored_at = ? WHERE url = ?', (now, now, url))
+            else:
+                self.conn.execute('UPDATE responses SET last_access = ? WHERE url = ?', (now, url))
+            self.conn.commit()
+
+    def _store(self, url: str, response: requests.Response):
+        if response.status_code != 200:
+            return
+        headers = {k: response.headers[k] for k in self._kept_headers if k in response.headers}
+        body = zlib.compress(response.content)
+        now = time.time()
+        with self._lock:
+            old = self.conn.execute('SELECT size FROM responses WHERE url = ?', (url,)).fetchone()
+            self.total_bytes -= old[0] if old else 0
+            self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (url, response.url, json.dumps(headers), body, len(body), now, now))
+            self.total_bytes += len(body)
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        """drop least recently used responses until the cache fits in max_bytes (caller holds the lock)"""
+        while self.total_bytes > self.max_bytes:
+            url, size = self.conn.execute(
+                'SELECT url, size FROM responses ORDER BY last_access LIMIT 1').fetchone()
+            self.conn.execute('DELETE FROM responses WHERE url = ?', (url,))
+            self.total_bytes -= size
+            self.evictions += 1
+            logger.debug(f'cache evicted: {url}')
+
+    @staticmethod
+    def _build_response(url: str, headers: dict, body: bytes) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = zlib.decompress(body)
+        return response
+
+    def close(self):
+        self.conn.close()
@@ -1,18 +1,147 @@
+import json
 import logging
+import os
+import re
 
 import branca
+from branca.element import MacroElement
 import folium
+from jinja2 import Template
 import numpy as np
 import pandas as pd
 
+from homing_in.metrics import METRICS
+from homing_in.results_store import ResultsStore
+
 logger = logging.getLogger(__name__)
 
 
+class _PointLayer(MacroElement):
+    """all points in one canvas layer, drawn and given popups in the browser from a single shared template
+
+    data holds one array per field, so each point costs a few numbers rather than its own marker and popup html
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var data = {{ this.data }};
+            var template = {{ this.popup_template }};
+            var escape = function(value) {
+                return String(value).replace(/[&<>"']/g, function(c) {
+                    return {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c];
+                });
+            };
+            var renderer = L.canvas();
+            var layer = L.featureGroup();
+            for (var i = 0; i < data.latitude.length; i++) {
+                var marker = L.circleMarker([data.latitude[i], data.longitude[i]], {
+                    radius: data.radius[i], color: 'black', fill: true, renderer: renderer,
+                    fillColor: data.interested[i] ? 'green' : 'blue'});
+                marker.pointIndex = i;
+                layer.addLayer(marker);
+            }
+            layer.bindPopup(function(marker) {
+                return template.replace(/\{(\w+)\}/g, function(match, field) {
+                    return field in data.fields ? escape(data.fields[field][marker.pointIndex]) : match;
+                });
+            }, {maxWidth: 2650});
+            layer.addTo({{ this._parent.get_name() }});
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, data: dict, popup_template: str):
+        super().__init__()
+        self._name = 'PointLayer'
+        self.data = json.dumps(data, separators=(',', ':'))
+        self.popup_template = json.dumps(popup_template)
+
+
+class _TileLoader(MacroElement):
+    """fetches the pre-aggregated tiles written by Mapper.save_tiles for the current viewport as the map moves"""
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var index = {{ this.index }};
+            var layer = L.featureGroup().addTo(map);
+            var loaded = {};
+            var layerZoom = null;
+            var available = {};
+            Object.keys(index.tiles).forEach(function(z) {
+                index.tiles[z].forEach(function(tile) { available[z + '/' + tile] = true; });
+            });
+            var colour = function(score) {
+                var t = Math.max(0, Math.min(1, (score - index.score_min) / ((index.score_max - index.score_min) || 1)));
+                return 'hsl(' + Math.round(240 * (1 - t)) + ', 80%, 45%)';
+            };
+            var drawTile = function(tile) {
+                for (var i = 0; i < tile.count.length; i++) {
+                    L.rectangle([[tile.south[i], tile.west[i]], [tile.north[i], tile.east[i]]], {
+                        weight: 0, fillOpacity: 0.5, fillColor: colour(tile.mean[i])
+                    }).bindPopup('properties: ' + tile.count[i] + '<br>mean score: ' + tile.mean[i].toFixed(2) +
+                                 '<br>max score: ' + tile.max[i].toFixed(2) + '<br>best id: ' + tile.best_id[i])
+                      .addTo(layer);
+                }
+            };
+            var refresh = function() {
+                var z = Math.max(index.min_zoom, Math.min(index.max_zoom, map.getZoom()));
+                if (z !== layerZoom) {
+                    layer.clearLayers();
+                    loaded = {};
+                    layerZoom = z;
+                }
+                var bounds = map.getBounds();
+                var n = Math.pow(2, z);
+                var tileX = function(lon) { return Math.floor((lon + 180) / 360 * n); };
+                var tileY = function(lat) {
+                    var rad = lat * Math.PI / 180;
+                    return Math.floor((1 - Math.log(Math.tan(rad) + 1 / Math.cos(rad)) / Math.PI) / 2 * n);
+                };
+                for (var x = tileX(bounds.getWest()); x <= tileX(bounds.getEast()); x++) {
+                    for (var y = tileY(bounds.getNorth()); y <= tileY(bounds.getSouth()); y++) {
+                        var key = z + '/' + x + '/' + y;
+                        if (loaded[key] || !available[key]) continue;
+                        loaded[key] = true;
+                        fetch(key + '.json').then(function(r) { return r.json(); }).then(drawTile);
+                    }
+                }
+            };
+            map.on('moveend', refresh);
+            refresh();
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, index: dict):
+        super().__init__()
+        self._name = 'TileLoader'
+        self.index = json.dumps(index, separators=(',', ':'))
+
+
 class Mapper:
+    # columns used to draw the map, only these are loaded from a ResultsStore
+    columns = ['id', 'latitude', 'longitude', 'total_score', 'beds', 'tenure', 'price', 'url', 'travel_time_angel',
+               'travel_time_cw']
+    # popup for create_map_with_layer, {column} is replaced with the property's value in the browser
+    popup_template = """id: {id},  score: {total_score},  beds: {beds},  tenure: {tenure},
+                price: {price},  travel angel: {travel_time_angel} (mins),
+                travel canary whary: {travel_time_cw} (mins)
+                   {url},  <a href = "{url}">open listing</a>"""
+
     def __init__(self, input_csv):
+        """
+
+        :param input_csv: results csv, a .parquet file written by ResultsStore or the results themselves
+        """
         self.style = 'cartodbpositron'
         self.map = folium.Map(location=(0, 0), zoom_start=6, tiles=self.style)
-        self.df = pd.read_csv(input_csv)
+        if isinstance(input_csv, pd.DataFrame):
+            self.df = input_csv
+        elif input_csv.endswith('.parquet'):
+            self.df = ResultsStore(input_csv).read(self.columns)
+        else:
+            self.df = pd.read_csv(input_csv)
 
     def create_basemap(self, centre_lat, centre_lon, zoom_level):
         self.map = folium.Map(location=(centre_lat, centre_lon), zoom_start=zoom_level, tiles=self.style)
@@ -44,12 +173,42 @@ class Mapper:
         </html>"""
         return html
 
-    def create_map_with_points(self, reference_df, zoom_level=13):
+    @staticmethod
+    def _reference_ids(reference_df) -> tuple:
+        """sets of the property ids marked interested and remove"""
         ref_df = pd.read_csv(reference_df)
-        interested = ref_df[ref_df['category'] == 'interested']
-        remove = ref_df[ref_df['category'] == 'remove']
-        interested_list = [] if len(interested) == 0 else interested['property_id'].tolist()
-        remove_list = [] if len(remove) == 0 else remove['property_id'].tolist()
+        interested = set(ref_df.loc[ref_df['category'] == 'interested', 'property_id'])
+        remove = set(ref_df.loc[ref_df['category'] == 'remove', 'property_id'])
+        return interested, remove
+
+    @METRICS.timed('map.layer')
+    def create_map_with_layer(self, reference_df, zoom_level=13, popup_template: str = None):
+        """same map as create_map_with_points, but sending every point as one data layer with popups built in the
+        browser, which keeps the saved html small and quick to open with thousands of properties
+
+        :param reference_df: csv of property_id and category ('interested' or 'remove')
+        :param zoom_level: initial zoom
+        :param popup_template: popup html with {column} placeholders, defaults to Mapper.popup_template
+        """
+        popup_template = popup_template or self.popup_template
+        interested, remove = self._reference_ids(reference_df)
+        df = self.df[self.df['latitude'].notna() & ~self.df['id'].isin(remove)]
+        logger.debug(f'skipping {len(self.df) - len(df)} properties (NaN coords or removed)')
+        fields = [f for f in dict.fromkeys(re.findall(r'\{(\w+)\}', popup_template)) if f in df.columns]
+        data = {
+            'latitude': df['latitude'].astype(float).round(6).tolist(),
+            'longitude': df['longitude'].astype(float).round(6).tolist(),
+            'radius': (df['total_score'].astype(float) / 2).tolist(),
+            'interested': df['id'].isin(interested).astype(int).tolist(),
+            'fields': {f: df[f].astype(object).where(df[f].notna(), None).tolist() for f in fields},
+        }
+        self.create_basemap(self.df['latitude'].mean(), self.df['longitude'].mean(), zoom_level)
+        _PointLayer(data, popup_template).add_to(self.map)
+        return self.map
+
+    @METRICS.timed('map.points')
+    def create_map_with_points(self, reference_df, zoom_level=13):
+        interested_list, remove_list = self._reference_ids(reference_df)
         # remove_df = pd.read_csv(remove_df)
         # interest_df = pd.read_csv(interested_df)
         # TODO reinstate above dfs
@@ -76,6 +235,93 @@ class Mapper:
                 logger.debug(f'skipping index: {index} (NaN coords)')
         return self.map
 
+    @staticmethod
+    def _mercator(lat: np.ndarray, lon: np.ndarray, zoom: int) -> tuple:
+        """fractional web mercator tile coordinates at zoom"""
+        n = 2 ** zoom
+        lat_rad = np.radians(lat)
+        x = (lon + 180) / 360 * n
+        y = (1 - np.log(np.tan(lat_rad) + 1 / np.cos(lat_rad)) / np.pi) / 2 * n
+        return x, y
+
+    @staticmethod
+    def _inverse_mercator(x: np.ndarray, y: np.ndarray, zoom: int) -> tuple:
+        n = 2 ** zoom
+        lon = x / n * 360 - 180
+        lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y / n))))
+        return lat, lon
+
+    @METRICS.timed('map.tiles')
+    def save_tiles(self, output_dir: str, zoom_levels=range(8, 17), cells_per_tile: int = 8,
+                   score_column: str = 'total_score') -> dict:
+        """bin the properties into grid cells at each zoom level and write them out as small per-tile json files
+
+        each cell holds the number of properties, their mean and max score and the id of the best scoring one.
+        tiles are written to output_dir/{zoom}/{x}/{y}.json along with index.json and map.html, which loads the tiles
+        in view as the map moves. browsers won't fetch local files, so serve output_dir e.g. with
+        python -m http.server. properties without coordinates or a score are left out, and if that leaves none only an
+        index.json without tiles is written
+
+        :param output_dir: directory to write to
+        :param zoom_levels: zoom levels to aggregate at
+        :param cells_per_tile: cells along each side of a (256 pixel) map tile
+        :param score_column: column to aggregate
+        :return: the index written to index.json
+        """
+        scores = pd.to_numeric(self.df[score_column], errors='coerce')
+        df = self.df[self.df['latitude'].notna() & self.df['longitude'].notna() & scores.notna()]
+        lat = df['latitude'].to_numpy(dtype=float)
+        lon = df['longitude'].to_numpy(dtype=float)
+        score = scores[df.index].to_numpy(dtype=float)
+        ids = df['id'].to_numpy()
+        index = {'min_zoom': min(zoom_levels), 'max_zoom': max(zoom_levels), 'cells_per_tile': cells_per_tile,
+                 'score_min': float(score.min()) if len(df) else None,
+                 'score_max': float(score.max()) if len(df) else None, 'tiles': {}}
+        os.makedirs(output_dir, exist_ok=True)
+        if len(df) == 0:
+            logger.warning(f'no properties with coordinates and a {score_column} to tile')
+            index['tiles'] = {zoom: [] for zoom in zoom_levels}
+            with open(os.path.join(output_dir, 'index.json'), 'w') as f:
+                json.dump(index, f, separators=(',', ':'))
+            return index
+        for zoom in zoom_levels:
+            x, y = self._mercator(lat, lon, zoom)
+            cells = pd.DataFrame({'cx': np.floor(x * cells_per_tile).astype(np.int64),
+                                  'cy': np.floor(y * cells_per_tile).astype(np.int64),
+                                  'score': score})
+            grouped = cells.groupby(['cx', 'cy'], sort=False)['score']
+            agg = grouped.agg(['count', 'mean', 'max'])
+            agg['best_id'] = ids[grouped.idxmax().to_numpy()] if len(agg) > 0 else []
+            agg = agg.reset_index()
+            cell_zoom = zoom + np.log2(cells_per_tile)
+            agg['north'], agg['west'] = self._inverse_mercator(agg['cx'], agg['cy'], cell_zoom)
+            agg['south'], agg['east'] = self._inverse_mercator(agg['cx'] + 1, agg['cy'] + 1, cell_zoom)
+            agg['tx'] = agg['cx'] // cells_per_tile
+            agg['ty'] = agg['cy'] // cells_per_tile
+            agg = agg.sort_values(['tx', 'ty'], kind='stable')
+            for c in ['north', 'west', 'south', 'east']:
+                agg[c] = agg[c].round(6)
+            columns = {c: agg[c].tolist() for c in ['north', 'west', 'south', 'east', 'count', 'mean', 'max', 'best_id']}
+            tile_keys = list(zip(agg['tx'].tolist(), agg['ty'].tolist()))
+            starts = [i for i in range(len(tile_keys)) if i == 0 or tile_keys[i] != tile_keys[i - 1]]
+            index['tiles'][zoom] = []
+            for start, end in zip(starts, starts[1:] + [len(tile_keys)]):
+                tx, ty = tile_keys[start]
+                tile_dir = os.path.join(output_dir, str(zoom), str(tx))
+                os.makedirs(tile_dir, exist_ok=True)
+                with open(os.path.join(tile_dir, f'{ty}.json'), 'w') as f:
+                    f.write(json.dumps({c: values[start:end] for c, values in columns.items()}, separators=(',', ':')))
+                index['tiles'][zoom].append(f'{tx}/{ty}')
+            logger.debug(f'zoom {zoom}: {len(agg)} cells in {len(index["tiles"][zoom])} tiles')
+        with open(os.path.join(output_dir, 'index.json'), 'w') as f:
+            json.dump(index, f, separators=(',', ':'))
+
+        self.create_basemap(np.mean(lat), np.mean(lon), max(min(zoom_levels), 12))
+        _TileLoader(index).add_to(self.map)
+        self.save_map(os.path.join(output_dir, 'map.html'))
+        return index
+
+    @METRICS.timed('map.save')
     def save_map(self, output_filepath):
         logger.info('saving file in %s' % output_filepath)
         self.map.save(output_filepath)
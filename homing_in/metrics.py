@@ -0,0 +1,145 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (seconds) of the http latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PROMETHEUS_PREFIX = 'homing_in'
+
+
+class Metrics:
+    """run metrics: wall time per stage, http latency and bytes per host, and named counters (rows dropped, api
+    calls, ...), exported as a json run report or a prometheus text file
+
+    stage times are summed over every thread that ran the stage, so concurrent stages can add up to more than the
+    run's wall time
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = datetime.now()
+            self.stages = defaultdict(lambda: {'seconds': 0.0, 'runs': 0})
+            self.hosts = defaultdict(lambda: {'buckets': [0] * (len(LATENCY_BUCKETS) + 1), 'seconds': 0.0,
+                                              'requests': 0, 'bytes': 0})
+            self.counters = defaultdict(int)
+
+    def add_time(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage]['seconds'] += seconds
+            self.stages[stage]['runs'] += 1
+
+    @contextmanager
+    def stage(self, name: str):
+        """time the body of the with block as stage name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed(self, name: str):
+        """decorator timing every call of the function as stage name"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe_request(self, host: str, seconds: float, size: int):
+        """record one http request to host taking seconds and downloading size bytes"""
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+        with self._lock:
+            tally = self.hosts[host]
+            tally['buckets'][bucket] += 1
+            tally['seconds'] += seconds
+            tally['requests'] += 1
+            tally['bytes'] += size
+
+    def count(self, name: str, value: int = 1, **labels):
+        """add value to the counter name, e.g. count('rows_dropped', 3, reason='truncated')"""
+        if value == 0:
+            return
+        with self._lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def report(self) -> dict:
+        with self._lock:
+            counters = defaultdict(list)
+            for (name, labels), value in sorted(self.counters.items()):
+                counters[name].append(dict(labels, value=value))
+            return {
+                'started': self.started.isoformat(timespec='seconds'),
+                'finished': datetime.now().isoformat(timespec='seconds'),
+                'stages': {name: dict(tally) for name, tally in self.stages.items()},
+                'http': {host: {'requests': tally['requests'], 'bytes': tally['bytes'], 'seconds': tally['seconds'],
+                                'latency_buckets': dict(zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'],
+                                                            tally['buckets']))}
+                         for host, tally in self.hosts.items()},
+                'counters': dict(counters),
+            }
+
+    def prometheus(self) -> str:
+        """the metrics in prometheus' text exposition format"""
+        families = defaultdict(list)  # (metric name, type) to samples, each family is written out together
+        p = PROMETHEUS_PREFIX
+        with self._lock:
+            for name, tally in sorted(self.stages.items()):
+                families[(f'{p}_stage_seconds_total', 'counter')].append((f'stage="{_escape(name)}"', tally['seconds']))
+                families[(f'{p}_stage_runs_total', 'counter')].append((f'stage="{_escape(name)}"', tally['runs']))
+            for host, tally in sorted(self.hosts.items()):
+                host = f'host="{_escape(host)}"'
+                histogram = families[(f'{p}_http_request_duration_seconds', 'histogram')]
+                cumulative = 0
+                for bound, n in zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'], tally['buckets']):
+                    cumulative += n
+                    histogram.append((f'{host},le="{bound}"', cumulative, '_bucket'))
+                histogram.append((host, tally['seconds'], '_sum'))
+                histogram.append((host, tally['requests'], '_count'))
+                families[(f'{p}_http_response_bytes_total', 'counter')].append((host, tally['bytes']))
+            for (name, labels), value in sorted(self.counters.items()):
+                label_text = ','.join(f'{k}="{_escape(str(v))}"' for k, v in labels)
+                families[(f'{p}_{name}_total', 'counter')].append((label_text, value))
+        lines = []
+        for (metric, kind), samples in families.items():
+            lines.append(f'# TYPE {metric} {kind}')
+            for labels, value, *suffix in samples:
+                name = metric + (suffix[0] if suffix else '')
+                lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def save_json(self, path: str):
+        _write_atomic(path, json.dumps(self.report(), indent=2))
+        logger.info(f'run report saved to {path}')
+
+    def save_prometheus(self, path: str):
+        """write the metrics for prometheus' textfile collector (written atomically, so it never scrapes half a file)"""
+        _write_atomic(path, self.prometheus())
+        logger.info(f'prometheus metrics saved to {path}')
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_atomic(path: str, text: str):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+# shared by default so a whole run (crawl, travel times, scoring, mapping) ends up in one report
+METRICS = Metrics()
@@ -0,0 +1,178 @@
+from datetime import timedelta
+import glob
+import hashlib
+import json
+import logging
+import os
+import pickle
+import time
+from typing import Callable, Dict, List
+
+import pandas as pd
+
+from homing_in.crawlers import Crawler
+from homing_in.mapper import Mapper
+from homing_in.metrics import METRICS
+from homing_in.results_store import ResultsStore
+from homing_in.scorer import Component, ScoringEngine
+from homing_in.search_constructor import SearchConstructor
+from homing_in.travel_time import Target, travel_times
+
+logger = logging.getLogger(__name__)
+
+# crawler arguments that don't change what it scrapes, only how
+CRAWL_RESOURCES = ('fetcher', 'store', 'checkpoint', 'parse_workers')
+
+
+class Stage:
+    """one step of a Pipeline, run as func(*outputs of inputs, **config, **resources)
+
+    :param name: name other stages refer to this one by
+    :param func: does the work
+    :param inputs: names of the stages whose outputs are passed to func, in order
+    :param config: parameters for func, a change to any of them reruns this stage and everything after it
+    :param resources: extra arguments for func that don't affect its output (fetchers, caches, worker counts...)
+    :param max_age: rerun once the cached output is older than this, e.g. a day for a crawl
+    :param cache: False to always run the stage
+    """
+    def __init__(self, name: str, func: Callable, inputs: List[str] = (), config: dict = None,
+                 resources: dict = None, max_age: timedelta = None, cache: bool = True):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.config = config or {}
+        self.resources = resources or {}
+        self.max_age = max_age
+        self.cache = cache
+
+
+class Pipeline:
+    """runs stages in dependency order, caching each stage's output under a hash of its config and its inputs'
+    hashes, so a rerun only executes stages whose config (or an upstream stage) changed
+
+    e.g. after a tweak to the score mapping only the score and map stages run, the crawl and travel times are loaded
+    from the cache
+
+    :param stages: the stages, each stage's inputs must be defined
+    :param cache_dir: where stage outputs are kept
+    """
+    def __init__(self, stages: List[Stage], cache_dir: str):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            for name in stage.inputs:
+                assert name in self.stages, f'{stage.name}: unknown input stage {name}'
+        self.last = stages[-1].name
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def fingerprint(self, name: str) -> str:
+        stage = self.stages[name]
+        key = json.dumps({'name': name, 'func': f'{stage.func.__module__}.{stage.func.__qualname__}',
+                          'config': stage.config, 'inputs': [self.fingerprint(i) for i in stage.inputs]},
+                         sort_keys=True, default=repr)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+    def _cache_path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, f'{name}-{self.fingerprint(name)}.pkl')
+
+    def _needs_run(self, name: str, force: set, memo: Dict[str, bool]) -> bool:
+        if name not in memo:
+            stage = self.stages[name]
+            path = self._cache_path(name)
+            stale = not stage.cache or name in force or not os.path.exists(path) or (
+                stage.max_age is not None and time.time() - os.path.getmtime(path) > stage.max_age.total_seconds())
+            # evaluate every input so the memo covers the whole graph
+            inputs_ran = [self._needs_run(i, force, memo) for i in stage.inputs]
+            memo[name] = stale or any(inputs_ran)
+        return memo[name]
+
+    def _output(self, name: str, needs_run: Dict[str, bool], outputs: dict):
+        if name in outputs:
+            return outputs[name]
+        stage = self.stages[name]
+        path = self._cache_path(name)
+        if not needs_run[name]:
+            logger.info(f'pipeline: {name} unchanged, loading {path}')
+            with open(path, 'rb') as f:
+                outputs[name] = pickle.load(f)
+            return outputs[name]
+        inputs = [self._output(i, needs_run, outputs) for i in stage.inputs]
+        logger.info(f'pipeline: running {name}')
+        start = time.perf_counter()
+        with METRICS.stage(f'pipeline.{name}'):
+            outputs[name] = stage.func(*inputs, **stage.config, **stage.resources)
+        logger.info(f'pipeline: {name} took {time.perf_counter() - start:.1f}s')
+        if stage.cache:
+            for old in glob.glob(os.path.join(self.cache_dir, f'{name}-*.pkl')):
+                os.remove(old)
+            with open(path, 'wb') as f:
+                pickle.dump(outputs[name], f)
+        return outputs[name]
+
+    def run(self, name: str = None, force: List[str] = ()):
+        """output of stage name (the last stage by default), running only what has changed
+
+        :param name: stage to produce
+        :param force: stages to rerun regardless of the cache (the stages after them rerun too)
+        """
+        name = name or self.last
+        needs_run = {}
+        self._needs_run(name, set(force), needs_run)
+        return self._output(name, needs_run, {})
+
+
+def _search(url: str):
+    search = SearchConstructor(url_type='fixed').create()
+    search.search(url)
+    return search
+
+
+def _crawl(search, max_pages: int, **crawler_kwargs) -> pd.DataFrame:
+    return ResultsStore.coerce(Crawler(search).create(**crawler_kwargs).scrape(max_pages=max_pages))
+
+
+def _travel(properties: pd.DataFrame, targets: List[Target], **travel_kwargs) -> pd.DataFrame:
+    return travel_times(properties, targets, **travel_kwargs)
+
+
+def _score(properties: pd.DataFrame, score_mapping: dict, components: List[Component]) -> pd.DataFrame:
+    return ScoringEngine(score_mapping, components).score(properties)
+
+
+def _map(properties: pd.DataFrame, reference_csv: str, output_html: str, reference_hash: str) -> str:
+    mapper = Mapper(properties)
+    mapper.create_map_with_layer(reference_csv)
+    mapper.save_map(output_html)
+    return output_html
+
+
+def _file_hash(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def search_stage(url: str, max_age: timedelta = timedelta(days=1)) -> Stage:
+    return Stage('search', _search, config={'url': url}, max_age=max_age)
+
+
+def crawl_stage(max_pages: int = 42, max_age: timedelta = timedelta(days=1), **crawler_kwargs) -> Stage:
+    """crawler_kwargs are passed to the crawler, those that change what it scrapes (extraction, shallow_fields,
+    detail_parser, max_detail_age...) are part of the cache key, the live objects in CRAWL_RESOURCES aren't"""
+    config = {key: value for key, value in crawler_kwargs.items() if key not in CRAWL_RESOURCES}
+    resources = {key: value for key, value in crawler_kwargs.items() if key in CRAWL_RESOURCES}
+    return Stage('crawl', _crawl, inputs=['search'], config=dict(config, max_pages=max_pages), resources=resources,
+                 max_age=max_age)
+
+
+def travel_stage(targets: List[Target], **travel_kwargs) -> Stage:
+    return Stage('travel', _travel, inputs=['crawl'], config={'targets': targets}, resources=travel_kwargs)
+
+
+def score_stage(score_mapping: dict, components: List[Component]) -> Stage:
+    return Stage('score', _score, inputs=['travel'], config={'score_mapping': score_mapping, 'components': components})
+
+
+def map_stage(reference_csv: str, output_html: str) -> Stage:
+    """the reference csv's contents are part of the cache key, so marking a property reruns the map"""
+    return Stage('map', _map, inputs=['score'], config={'reference_csv': reference_csv, 'output_html': output_html,
+                                                        'reference_hash': _file_hash(reference_csv)})
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+import logging
+import sqlite3
+from typing import Iterable
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class PropertyStore:
+    """persistent store of property details (beds, tenure, coordinates) keyed by rightmove property id
+
+    lets a crawler skip detail pages for properties it has already seen recently
+    """
+    detail_columns = ['beds', 'tenure', 'latitude', 'longitude']
+    _query_chunk = 500  # stay well below sqlite's limit on bound parameters
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS properties (
+            id TEXT PRIMARY KEY, beds TEXT, tenure TEXT, latitude TEXT, longitude TEXT, scrape_time TEXT)""")
+        self.conn.commit()
+
+    def fresh(self, ids: Iterable[str], max_age: timedelta) -> pd.DataFrame:
+        """details for any of ids scraped within max_age, as columns of detail_columns and id
+
+        records without coordinates are left out (so refetched), as that is what details read from an error page
+        look like
+        """
+        ids = list(ids)
+        oldest = (datetime.today() - max_age).isoformat()
+        rows = []
+        for i in range(0, len(ids), self._query_chunk):
+            chunk = ids[i:i + self._query_chunk]
+            placeholders = ','.join('?' * len(chunk))
+            rows += self.conn.execute(
+                f'SELECT beds, tenure, latitude, longitude, id FROM properties '
+                f'WHERE id IN ({placeholders}) AND scrape_time >= ? AND latitude IS NOT NULL',
+                chunk + [oldest]).fetchall()
+        logger.info(f'property store: {len(rows)} of {len(ids)} properties known')
+        return pd.DataFrame(rows, columns=self.detail_columns + ['id'])
+
+    def update(self, property_details: pd.DataFrame, scrape_time: datetime = None):
+        scrape_time = (scrape_time or datetime.today()).isoformat()
+        rows = [(str(row['id']), row['beds'], row['tenure'], row['latitude'], row['longitude'], scrape_time)
+                for row in property_details.to_dict('records')]
+        self.conn.executemany('INSERT OR REPLACE INTO properties VALUES (?, ?, ?, ?, ?, ?)', rows)
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM properties').fetchone()[0]
+
+    def close(self):
+        self.conn.close()
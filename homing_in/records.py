@@ -0,0 +1,174 @@
+from array import array
+import math
+from typing import Dict, Hashable, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+# column types a RecordBuffer can hold: int is int64 (or Int64 when a value is missing), Int64 is always nullable,
+# str is any python object and is left to pandas to infer
+COLUMN_TYPES = ['int', 'Int64', 'float', 'str', 'datetime']
+
+
+class _Column:
+    """one typed, append only column: ints and datetimes (as ns) in an int64 array with a missing mask, floats in a
+    double array with nan for missing, anything else in a list with None for missing"""
+    __slots__ = ['kind', 'values', 'missing']
+
+    def __init__(self, kind: str):
+        assert kind in COLUMN_TYPES, f'column type must be one of {COLUMN_TYPES} (chosen: {kind})'
+        self.kind = kind
+        masked = kind in ('int', 'Int64', 'datetime')
+        self.values = array('q') if masked else array('d') if kind == 'float' else []
+        self.missing = bytearray() if masked else None
+
+    def _encode(self, value):
+        if self.kind == 'datetime':
+            return pd.Timestamp(value).value
+        if self.kind == 'float':
+            return math.nan if value is None else float(value)
+        return value
+
+    def extend(self, values: list):
+        if self.missing is None:
+            self.values.extend(values if self.kind == 'str' else [self._encode(v) for v in values])
+            return
+        if self.kind != 'datetime' and None not in values:
+            self.values.extend(values)
+            self.missing.extend(bytes(len(values)))
+            return
+        self.values.extend(0 if v is None else self._encode(v) for v in values)
+        self.missing.extend(v is None for v in values)
+
+    def extend_value(self, value, n: int):
+        """add value n times, it is only encoded once"""
+        if value is None:
+            self.extend_missing(n)
+            return
+        self.values.extend([self._encode(value)] * n)
+        if self.missing is not None:
+            self.missing.extend(bytes(n))
+
+    def extend_missing(self, n: int):
+        if self.missing is None:
+            self.values.extend([math.nan] * n if self.kind == 'float' else [None] * n)
+        else:
+            self.values.extend([0] * n)
+            self.missing.extend(b'\x01' * n)
+
+    def is_missing(self, row: int) -> bool:
+        if self.missing is not None:
+            return bool(self.missing[row])
+        return math.isnan(self.values[row]) if self.kind == 'float' else self.values[row] is None
+
+    def get(self, row: int):
+        if self.is_missing(row):
+            return None
+        value = self.values[row]
+        return pd.Timestamp(value) if self.kind == 'datetime' else value
+
+    def set(self, row: int, value):
+        if self.missing is None:
+            self.values[row] = self._encode(value)
+        else:
+            self.values[row] = 0 if value is None else self._encode(value)
+            self.missing[row] = value is None
+
+    def series(self) -> pd.Series:
+        if self.kind == 'str':
+            return pd.Series(self.values, dtype=None if self.values else 'object')
+        values = np.frombuffer(self.values, dtype='int64' if self.missing is not None else 'float64')
+        if self.kind == 'float':
+            return pd.Series(values.copy())
+        missing = np.frombuffer(self.missing, dtype='bool')
+        if self.kind == 'datetime':
+            dates = values.astype('datetime64[ns]')
+            dates[missing] = np.datetime64('NaT')
+            return pd.Series(dates)
+        if self.kind == 'Int64' or missing.any():
+            return pd.Series(pd.arrays.IntegerArray(values.copy(), missing.copy()))
+        return pd.Series(values.copy())
+
+
+class RecordBuffer:
+    """append only records of a fixed schema, held as typed columns and turned into a DataFrame once at the end
+
+    records are deduplicated by key as they are added (the first one in wins), and fields left missing can be filled
+    in later by key, e.g. a property's details once its detail page has been read
+
+    :param schema: column name to column type, one of COLUMN_TYPES
+    :param key: column records are deduplicated and looked up by, None to keep every record
+    :param seen: keys to treat as already added, shared between buffers to deduplicate across them
+    """
+    __slots__ = ['schema', 'key', 'seen', '_columns', '_rows']
+
+    def __init__(self, schema: Dict[str, str], key: str = 'id', seen: set = None):
+        assert key is None or key in schema, f'key must be one of the schema columns (chosen: {key})'
+        self.schema = dict(schema)
+        self.key = key
+        self.seen = set() if seen is None else seen
+        self._columns = {name: _Column(kind) for name, kind in self.schema.items()}
+        self._rows = {}  # key to row number, for the keys added to this buffer
+
+    def __len__(self) -> int:
+        return len(next(iter(self._columns.values())).values) if self._columns else 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._rows
+
+    def keys(self) -> List[Hashable]:
+        return list(self._rows)
+
+    def extend(self, columns: Dict[str, list]) -> List[Hashable]:
+        """add the records in columns (a list per column, or one value for every record), returning the keys of any
+        that were skipped as already added
+
+        schema columns not in columns are left missing
+        """
+        unknown = set(columns) - set(self.schema)
+        assert not unknown, f'columns not in the schema: {sorted(unknown)}'
+        n = max((len(v) for v in columns.values() if isinstance(v, list)), default=0)
+        skipped = []
+        if self.key is not None:
+            keep = []
+            for i, key in enumerate(columns[self.key]):
+                if key in self.seen:
+                    skipped.append(key)
+                    continue
+                self.seen.add(key)
+                self._rows[key] = len(self) + len(keep)
+                keep.append(i)
+            if skipped:
+                columns = {name: [v[i] for i in keep] if isinstance(v, list) else v for name, v in columns.items()}
+                n = len(keep)
+        for name, column in self._columns.items():
+            if name not in columns:
+                column.extend_missing(n)
+            elif isinstance(columns[name], list):
+                column.extend(columns[name])
+            else:
+                column.extend_value(columns[name], n)
+        return skipped
+
+    def get(self, key: Hashable, column: str):
+        """the value of column for key's record, None when it is missing"""
+        return self._columns[column].get(self._rows[key])
+
+    def set(self, key: Hashable, column: str, value):
+        self._columns[column].set(self._rows[key], value)
+
+    def fill(self, key: Hashable, values: dict):
+        """set the fields in values that are still missing from key's record, keeping any it already has"""
+        row = self._rows[key]
+        for name, value in values.items():
+            column = self._columns.get(name)
+            if column is not None and column.is_missing(row):
+                column.set(row, value)
+
+    def missing(self, key: Hashable, columns: Iterable[str]) -> bool:
+        """whether key's record is missing any of columns"""
+        row = self._rows[key]
+        return any(self._columns[name].is_missing(row) for name in columns)
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({name: column.series() for name, column in self._columns.items()})
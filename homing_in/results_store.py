@@ -0,0 +1,69 @@
+import logging
+from typing import List
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+# dtypes for the columns the crawler produces, travel time columns are matched by TRAVEL_TIME_PREFIX
+SCHEMA = {
+    'address': 'string',
+    'agent_url': 'string',
+    'description': 'string',
+    'id': 'int64',
+    'page_number': 'int16',
+    'price': 'Int64',
+    'scrape_time': 'datetime64[ns]',
+    'url': 'string',
+    'beds': 'category',
+    'latitude': 'float32',
+    'longitude': 'float32',
+    'tenure': 'category',
+}
+TRAVEL_TIME_PREFIX = 'travel_time'
+TRAVEL_TIME_DTYPE = 'float32'
+
+
+class ResultsStore:
+    """results kept as parquet with a fixed schema, so every stage reads back the same dtypes and can load only the
+    columns it needs
+
+    e.g. ResultsStore('output/results.parquet').read(['id', 'latitude', 'longitude'])
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+    @staticmethod
+    def coerce(df: pd.DataFrame) -> pd.DataFrame:
+        """copy of df with the schema dtypes applied, columns outside the schema are left as they are"""
+        df = df.copy()
+        for column in df.columns:
+            dtype = SCHEMA.get(column)
+            if dtype is None and column.startswith(TRAVEL_TIME_PREFIX):
+                dtype = TRAVEL_TIME_DTYPE
+            if dtype is None:
+                continue
+            if dtype == 'category':  # values like beds come back from csv as numbers, keep them as labels
+                df[column] = df[column].where(df[column].isna(), df[column].astype(str)).astype('category')
+            elif dtype == 'Int64':
+                df[column] = pd.to_numeric(df[column], errors='coerce').round().astype(dtype)
+            elif dtype.startswith('datetime'):
+                df[column] = pd.to_datetime(df[column]).astype(dtype)
+            else:
+                df[column] = df[column].astype(dtype)
+        return df
+
+    def write(self, df: pd.DataFrame):
+        logger.info(f'saving {len(df)} results in {self.path}')
+        self.coerce(df).to_parquet(self.path, index=False)
+
+    def columns(self) -> List[str]:
+        return pq.read_schema(self.path).names
+
+    def read(self, columns: List[str] = None) -> pd.DataFrame:
+        """load the results, only reading the given columns (any not in the file are skipped)"""
+        if columns is not None:
+            available = set(self.columns())
+            columns = [c for c in columns if c in available]
+        return pd.read_parquet(self.path, columns=columns)
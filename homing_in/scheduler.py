@@ -0,0 +1,140 @@
+from collections import defaultdict
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# requests per second allowed to each host, hosts not listed here are only limited once they start throttling
+DEFAULT_RATES = {
+    'www.rightmove.co.uk': 10,
+    'maps.googleapis.com': 50,
+}
+
+
+class TokenBucket:
+    """rate limiter allowing rate requests per second on average and bursts of up to capacity
+
+    the rate is halved whenever the host pushes back and recovers gradually as requests succeed again
+
+    :param rate: requests per second, None for no limit until the first slow_down
+    :param capacity: largest burst allowed
+    """
+    def __init__(self, rate: float = None, capacity: float = None):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity or max(rate or 1, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """block until a request is allowed"""
+        while True:
+            with self._lock:
+                if self.rate is None:
+                    return
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def slow_down(self, min_rate: float = 0.1):
+        with self._lock:
+            current = self.rate if self.rate is not None else self.capacity
+            self.rate = max(min_rate, current / 2)
+            self.tokens = min(self.tokens, 1)
+
+    def speed_up(self):
+        with self._lock:
+            if self.rate is None:
+                return
+            if self.base_rate is not None and self.rate >= self.base_rate:
+                self.rate = self.base_rate
+                return
+            self.rate += max(0.1, self.rate * 0.05)
+
+
+class RequestScheduler:
+    """every outbound request goes through call, which waits for the host's token bucket, retries throttled or
+    failed requests with exponential backoff and keeps a tally of the requests made to each host
+
+    :param rates: requests per second per host (see DEFAULT_RATES)
+    :param max_retries: retries after the first attempt before giving up
+    :param backoff: seconds to wait before the first retry, doubling on each further retry
+    :param max_backoff: longest wait between retries
+    """
+    def __init__(self, rates: Dict[str, float] = None, max_retries: int = 4, backoff: float = 1.0,
+                 max_backoff: float = 60.0):
+        self.rates = DEFAULT_RATES if rates is None else rates
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.quota = defaultdict(lambda: {'requests': 0, 'retries': 0, 'throttled': 0, 'failed': 0})
+
+    def bucket(self, host: str) -> TokenBucket:
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rates.get(host))
+            return self._buckets[host]
+
+    def _count(self, host: str, tally: str):
+        with self._lock:
+            self.quota[host][tally] += 1
+
+    def call(self, host: str, request: Callable[[], T], classify: Callable[[T], str] = None,
+             retryable: Callable[[Exception], str] = None) -> T:
+        """make request, retrying while classify says the result (or retryable says the exception) should be retried
+
+        :param host: host (or api) to rate limit and tally the request against
+        :param request: makes the request
+        :param classify: reason to retry a result (e.g. 'throttled' for a 429), or None if it is fine
+        :param retryable: reason to retry after an exception, or None to raise it straight away
+        :return: the result, or the last result once retries run out (a last exception is raised)
+        """
+        bucket = self.bucket(host)
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            self._count(host, 'requests')
+            if attempt > 0:
+                self._count(host, 'retries')
+            try:
+                result = request()
+            except Exception as e:
+                reason = retryable(e) if retryable is not None else None
+                if reason is None or attempt == self.max_retries:
+                    self._count(host, 'failed')
+                    raise
+            else:
+                reason = classify(result) if classify is not None else None
+                if reason is None:
+                    bucket.speed_up()
+                    return result
+                if attempt == self.max_retries:
+                    self._count(host, 'failed')
+                    logger.error(f'{host}: giving up after {attempt + 1} attempts ({reason})')
+                    return result
+            if reason == 'throttled':
+                self._count(host, 'throttled')
+                bucket.slow_down()
+            wait = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1)
+            logger.warning(f'{host}: {reason}, retrying in {wait:.1f}s')
+            time.sleep(wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {host: dict(tally, rate=self._buckets[host].rate) for host, tally in self.quota.items()}
+
+
+# shared by default so every crawler, fetcher and travel time call counts against the same limits
+SCHEDULER = RequestScheduler()
@@ -1,7 +1,39 @@
+from collections import namedtuple
+from itertools import product
 import logging
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from homing_in.metrics import METRICS
 
 logger = logging.getLogger(__name__)
 
+# one score column for ScoringEngine: kind is 'value_map', 'price' or 'travel_time', mapping_key picks the parameters
+# out of the score mapping and the score is multiplied by weight
+Component = namedtuple('Component', ['column', 'source', 'kind', 'mapping_key', 'weight'], defaults=[1])
+
+# the result of ScoringEngine.sweep: variants are the parameters each variant changed, totals the total score of every
+# property (rows) under every variant (columns), top the row positions of each variant's k best properties (best
+# first, one row per variant) and stability how far each variant's ranking moved from the unchanged score mapping's
+Sweep = namedtuple('Sweep', ['variants', 'totals', 'top', 'stability'])
+
+
+def parameter_grid(grid: Dict[Tuple[str, str], list]) -> List[dict]:
+    """every combination of the values in grid, as variants for ScoringEngine.sweep
+
+    e.g. parameter_grid({('price', 'max_desired'): [600000, 650000, 700000], ('beds', '3'): [5, 10]}) is six
+    variants, each setting max_desired in the 'price' mapping and the score for '3' in the 'beds' mapping
+    """
+    return [dict(zip(grid, values)) for values in product(*grid.values())]
+
+
+def _as_float(values) -> np.ndarray:
+    if isinstance(values, pd.Series):
+        return values.to_numpy(dtype=float, na_value=np.nan)
+    return np.asarray(values, dtype=float)
+
 
 class Scorer:
     @classmethod
@@ -48,5 +80,141 @@ class Scorer:
         return score
 
 
-if __name__ == '__main__':
-    a = Scorer.travel_time(50, 30, 50, 10, -0.5, -3)
+class ScoringEngine:
+    """scores a whole frame at once with the same formulas (and results) as Scorer
+
+    e.g. ScoringEngine(SCORE_MAPPING, [Component('bedroom_score', 'beds', 'value_map', 'beds'),
+                                       Component('price_score', 'price', 'price', 'price'),
+                                       Component('tt_score_cp', 'travel_time_cp', 'travel_time', 'travel_time', 0.5)])
+
+    to try out changes to the score mapping, sweep scores every property under many variants of it at once, e.g.
+    engine.sweep(df, parameter_grid({('price', 'max_desired'): [600000, 700000], ('travel_time', 'bad_minutes'):
+    [40, 45, 50]}), k=20)
+
+    :param score_mapping: parameters for each mapping_key, in the SCORE_MAPPING structure used by the examples
+    :param components: score columns to create, the total is the sum of all of them
+    :param total_column: name of the total score column
+    """
+    kinds = ['value_map', 'price', 'travel_time']
+
+    def __init__(self, score_mapping: dict, components: List[Component], total_column: str = 'total_score'):
+        for component in components:
+            assert component.kind in self.kinds, f'kind must be one of {self.kinds} (chosen: {component.kind})'
+            params = score_mapping[component.mapping_key]
+            if component.kind == 'value_map':
+                assert 'other' in params, 'mapping must contain "other" key'
+            elif component.kind == 'travel_time':
+                assert params['over_ideal_cost'] < 0 and params['over_bad_cost'] < 0, 'costs should both be negative'
+        self.score_mapping = score_mapping
+        self.components = components
+        self.total_column = total_column
+
+    @staticmethod
+    def value_map(values: pd.Series, mapping: dict) -> np.ndarray:
+        keys = list(mapping)
+        codes = pd.Categorical(values, categories=keys).codes
+        lookup = np.array([mapping[k] for k in keys] + [mapping['other']])
+        return lookup[codes]  # code -1 (not in mapping) picks 'other' from the end of lookup
+
+    @staticmethod
+    def price(prices: pd.Series, max_desired: int, score_per_under: int, score_per_over: int,
+              units: int) -> np.ndarray:
+        """prices can also be an array, broadcast against array parameters (as sweep does)"""
+        diff_to_desired = (max_desired - _as_float(prices)) / units
+        return np.where(diff_to_desired == 0, 0,
+                        np.where(diff_to_desired > 0, diff_to_desired * score_per_under,
+                                 np.abs(diff_to_desired) * score_per_over))
+
+    @staticmethod
+    def travel_time(minutes: pd.Series, ideal_minutes: int, bad_minutes: int, ideal_score,
+                    over_ideal_cost: float, over_bad_cost: float) -> np.ndarray:
+        """minutes can also be an array, broadcast against array parameters (as sweep does)"""
+        minutes = _as_float(minutes)
+        score = ideal_score + np.where(minutes > ideal_minutes,
+                                       (np.minimum(minutes, bad_minutes) - ideal_minutes) * over_ideal_cost, 0)
+        return score + np.where(minutes > bad_minutes, (minutes - bad_minutes) * over_bad_cost, 0)
+
+    @METRICS.timed('score')
+    def score(self, df: pd.DataFrame) -> pd.DataFrame:
+        """copy of df with a column for each component plus the total"""
+        out = df.copy()
+        for component in self.components:
+            params = self.score_mapping[component.mapping_key]
+            if component.kind == 'value_map':
+                score = self.value_map(df[component.source], params)
+            else:
+                score = getattr(self, component.kind)(df[component.source], **params)
+            out[component.column] = score if component.weight == 1 else score * component.weight
+        out[self.total_column] = out[[c.column for c in self.components]].sum(axis=1)
+        return out
+
+    def _check_variants(self, variants: List[dict]):
+        used = {component.mapping_key: component.kind for component in self.components}
+        for variant in variants:
+            for mapping_key, param in variant:
+                assert mapping_key in used, f'no component uses mapping_key {mapping_key} (from variant {variant})'
+                assert used[mapping_key] == 'value_map' or param in self.score_mapping[mapping_key], \
+                    f'{param} is not a parameter of {mapping_key} (from variant {variant})'
+                if param in ('over_ideal_cost', 'over_bad_cost'):
+                    assert variant[(mapping_key, param)] < 0, f'costs should both be negative (variant {variant})'
+
+    def _component_scores(self, component: Component, values: pd.Series, variants: List[dict]) -> tuple:
+        """component's weighted score for every property under each distinct change variants make to its parameters
+        (one row per change, nan as 0), and the row each variant uses"""
+        params = self.score_mapping[component.mapping_key]
+        changes = [tuple((param, value) for (key, param), value in variant.items() if key == component.mapping_key)
+                   for variant in variants]
+        distinct = {change: i for i, change in enumerate(dict.fromkeys(changes))}
+        rows = np.array([distinct[change] for change in changes])
+        changes = [dict(change) for change in distinct]
+        if component.kind == 'value_map':
+            keys = list(dict.fromkeys(list(params) + [key for change in changes for key in change]))
+            keys.remove('other')
+            codes = pd.Categorical(values, categories=keys).codes
+            # a row per change, a column per key (a key only some changes add falls to 'other' in the rest) then 'other'
+            lookup = np.array([[change.get(key, params.get(key, change.get('other', params['other'])))
+                                for key in keys + ['other']] for change in changes], dtype=float)
+            score = lookup[:, codes]
+        else:
+            arrays = {name: np.array([change.get(name, value) for change in changes], dtype=float)[:, None]
+                      for name, value in params.items()}
+            score = getattr(self, component.kind)(_as_float(values)[None, :], **arrays)
+        score = np.nan_to_num(score if component.weight == 1 else score * component.weight)  # as sum() skips nan
+        return score, rows
+
+    def sweep(self, df: pd.DataFrame, variants: List[dict], k: int = 10) -> Sweep:
+        """score every property in df under every variant of the score mapping at once
+
+        :param variants: changes to the score mapping, each mapping (mapping_key, parameter) to a value, e.g. from
+            parameter_grid. value_map variants can add keys, e.g. ('beds', '5')
+        :param k: number of best properties to find for each variant
+        :return: Sweep of the totals (the same as score's total_column under each variant) and each variant's top k.
+            stability has a column per parameter varied, top_k_jaccard (the overlap between the variant's top k and
+            the unchanged score mapping's) and top_k_spearman (rank correlation between how the unchanged mapping
+            and the variant order the unchanged mapping's top k)
+        """
+        self._check_variants(variants)
+        n, k = len(df), min(k, len(df))
+        # one row per variant, row 0 is the unchanged score mapping that stability is measured against
+        totals = np.zeros((len(variants) + 1, n))
+        for component in self.components:
+            score, rows = self._component_scores(component, df[component.source], [{}] + variants)
+            totals += score[rows] if len(score) > 1 else score
+        top = np.argpartition(-totals, k - 1, axis=1)[:, :k] if k > 0 else np.zeros((len(totals), 0), dtype=int)
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(totals, top, axis=1), axis=1, kind='stable'),
+                                 axis=1)
+
+        in_baseline_top = np.zeros(n, dtype=bool)
+        in_baseline_top[top[0]] = True
+        overlap = in_baseline_top[top[1:]].sum(axis=1)
+        ranks = pd.DataFrame(totals[:, top[0]].T).rank().to_numpy()
+        ranks = ranks - ranks.mean(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            spearman = (ranks[:, 1:] * ranks[:, :1]).sum(axis=0) / np.sqrt(
+                (ranks[:, 1:] ** 2).sum(axis=0) * (ranks[:, 0] ** 2).sum())
+            jaccard = overlap / (2 * k - overlap)
+        stability = pd.DataFrame([{f'{key}.{param}': value for (key, param), value in variant.items()}
+                                  for variant in variants], index=range(len(variants)))
+        stability['top_k_jaccard'] = jaccard
+        stability['top_k_spearman'] = spearman
+        return Sweep(variants, totals[1:].T, top[1:], stability)
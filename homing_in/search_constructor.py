@@ -1,6 +1,6 @@
 
 
-import requests
+from homing_in.fetcher import Fetcher
 
 
 class SearchConstructor:
@@ -41,8 +41,8 @@ class FixedSearch(SearchConstructor):
     def __init__(self):
         super().__init__('fixed')
 
-    def search(self, url):
-        self.response = requests.get(url)
+    def search(self, url, fetcher: Fetcher = None):
+        self.response = (fetcher or Fetcher()).get(url)
         self.validated_url = self._validate_url(self.response)
         self.search_type = self._check_search_type()
 
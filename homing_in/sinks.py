@@ -0,0 +1,38 @@
+import logging
+import os
+from typing import Iterable
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class CsvSink:
+    """appends frames to a csv as they arrive, e.g. CsvSink('output/results.csv').consume(crawler.iter_properties())
+
+    the first frame written sets the columns, later frames are written in the same column order
+    """
+    def __init__(self, path: str, append: bool = False):
+        self.path = path
+        self.columns = None
+        self.rows_written = 0
+        if not append and os.path.exists(path):
+            os.remove(path)
+        elif append and os.path.exists(path) and os.path.getsize(path) > 0:
+            self.columns = pd.read_csv(path, nrows=0).columns.tolist()
+
+    def write(self, df: pd.DataFrame):
+        if len(df) == 0:
+            return
+        header = self.columns is None
+        if header:
+            self.columns = df.columns.tolist()
+        df.reindex(columns=self.columns).to_csv(self.path, mode='a', header=header, index=False)
+        self.rows_written += len(df)
+        logger.debug(f'{self.path}: {self.rows_written} rows written')
+
+    def consume(self, frames: Iterable[pd.DataFrame]) -> int:
+        """write every frame, returning the number of rows written"""
+        for df in frames:
+            self.write(df)
+        return self.rows_written
@@ -0,0 +1,171 @@
+import logging
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_M = 6371000
+
+
+class SpatialIndex:
+    """uniform grid over latitude / longitude for radius and nearest neighbour queries
+
+    points are projected to metres around the mean latitude (plenty accurate across a city) and bucketed into square
+    cells, so a query only has to measure distances to points in the few cells it overlaps
+
+    :param latitudes: point latitudes (NaN points are never returned)
+    :param longitudes: point longitudes
+    :param cell_size_m: side of each grid cell, roughly the radius of typical queries works well
+    """
+    def __init__(self, latitudes, longitudes, cell_size_m: float = 250):
+        lat = np.asarray(latitudes, dtype=float)
+        long = np.asarray(longitudes, dtype=float)
+        valid = ~(np.isnan(lat) | np.isnan(long))
+        self.cell_size_m = cell_size_m
+        self.ref_lat = float(np.mean(lat[valid])) if valid.any() else 0.0
+        self.positions = np.flatnonzero(valid)
+        self.xy = self._project(lat[valid], long[valid])
+        cells = np.floor(self.xy / cell_size_m).astype(np.int64)
+        order = np.lexsort((cells[:, 1], cells[:, 0]))
+        self._sorted = order
+        sorted_cells = cells[order]
+        if len(order) > 0:
+            starts = np.flatnonzero(np.r_[True, np.any(sorted_cells[1:] != sorted_cells[:-1], axis=1)])
+            ends = np.r_[starts[1:], len(order)]
+        else:  # no valid coordinates, e.g. a crawl whose detail pages all failed, so every query finds nothing
+            starts = ends = np.empty(0, dtype=np.int64)
+        self._buckets = {(int(sorted_cells[s, 0]), int(sorted_cells[s, 1])): (s, e) for s, e in zip(starts, ends)}
+        # the occupied cells as arrays, for queries whose square covers more cells than there are occupied ones
+        self._bucket_cells = sorted_cells[starts]
+        self._bucket_spans = np.column_stack([starts, ends])
+        self._cell_bounds = (self._bucket_cells.min(axis=0), self._bucket_cells.max(axis=0)) if self._buckets else None
+
+    def _project(self, lat, long) -> np.ndarray:
+        """equirectangular projection to metres"""
+        x = np.radians(long) * EARTH_RADIUS_M * np.cos(np.radians(self.ref_lat))
+        y = np.radians(lat) * EARTH_RADIUS_M
+        return np.column_stack([x, y])
+
+    def _candidates(self, xy: np.ndarray, radius_m: float) -> np.ndarray:
+        """index (into self.xy) of every point in a cell within radius_m of xy"""
+        if self._cell_bounds is None:
+            return np.empty(0, dtype=np.int64)
+        # clamped to the occupied cells, so a query far from the points doesn't visit the empty cells in between
+        lo = np.maximum(np.floor((xy - radius_m) / self.cell_size_m).astype(np.int64), self._cell_bounds[0])
+        hi = np.minimum(np.floor((xy + radius_m) / self.cell_size_m).astype(np.int64), self._cell_bounds[1])
+        if np.prod(np.maximum(hi - lo + 1, 0)) > len(self._buckets):
+            inside = np.all((self._bucket_cells >= lo) & (self._bucket_cells <= hi), axis=1)
+            found = [self._sorted[s:e] for s, e in self._bucket_spans[inside]]
+        else:
+            found = [self._sorted[s:e] for cx in range(lo[0], hi[0] + 1) for cy in range(lo[1], hi[1] + 1)
+                     for s, e in [self._buckets.get((cx, cy), (0, 0))]]
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+
+    def query_radius(self, lat: float, long: float, radius_m: float) -> np.ndarray:
+        """positions of the points within radius_m of (lat, long), nearest first"""
+        xy = self._project(np.array([lat]), np.array([long]))[0]
+        candidates = self._candidates(xy, radius_m)
+        distances = np.hypot(*(self.xy[candidates] - xy).T)
+        within = distances <= radius_m
+        return self.positions[candidates[within][np.argsort(distances[within], kind='stable')]]
+
+    def nearest(self, lat: float, long: float, k: int = 1) -> np.ndarray:
+        """positions of the k points nearest to (lat, long), nearest first"""
+        k = min(k, len(self.positions))
+        xy = self._project(np.array([lat]), np.array([long]))[0]
+        radius_m = self.cell_size_m
+        while True:
+            candidates = self._candidates(xy, radius_m)
+            distances = np.hypot(*(self.xy[candidates] - xy).T)
+            # the k-th nearest is only certain once it is within the searched radius
+            if (distances <= radius_m).sum() >= k or len(candidates) == len(self.positions):
+                return self.positions[candidates[np.argsort(distances, kind='stable')[:k]]]
+            radius_m *= 2
+
+    def pairs_within(self, radius_m: float) -> np.ndarray:
+        """every pair of positions (i < j) closer than radius_m, as an (n, 2) array"""
+        cells = pd.DataFrame(np.floor(self.xy / self.cell_size_m).astype(np.int64), columns=['cx', 'cy'])
+        cells['i'] = np.arange(len(cells))
+        reach = int(np.ceil(radius_m / self.cell_size_m))
+        pairs = []
+        for dx in range(-reach, reach + 1):
+            for dy in range(-reach, reach + 1):
+                shifted = cells.assign(cx=cells['cx'] + dx, cy=cells['cy'] + dy)
+                joined = cells.merge(shifted, on=['cx', 'cy'], suffixes=('', '_other'))
+                i, j = joined['i'].to_numpy(), joined['i_other'].to_numpy()
+                keep = i < j
+                i, j = i[keep], j[keep]
+                close = np.hypot(*(self.xy[i] - self.xy[j]).T) <= radius_m
+                pairs.append(np.column_stack([i[close], j[close]]))
+        pairs = np.concatenate(pairs)
+        return self.positions[pairs]
+
+
+def _group_labels(n: int, pairs: np.ndarray) -> np.ndarray:
+    """connected components of the pairs, labelled by their lowest position"""
+    parent = np.arange(n)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in pairs:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+    return np.array([find(i) for i in range(n)])
+
+
+def dedup_listings(df: pd.DataFrame, radius_m: float = 25, price_tolerance: float = 0.02,
+                   match_columns: List[str] = ('beds',)) -> pd.DataFrame:
+    """collapse listings of the same property posted by different agents
+
+    listings are duplicates when they are within radius_m of each other, their prices are within price_tolerance
+    (as a fraction of the lower price) and they agree on match_columns. the first listing of each group is kept,
+    with the ids of the listings folded into it in duplicate_ids
+
+    :param df: listings with id, price, latitude and longitude columns
+    :param radius_m: how far apart two listings of the same property can be
+    :param price_tolerance: allowed relative difference in price
+    :param match_columns: columns that must be equal
+    :return: df without the duplicates, plus a duplicate_ids column
+    """
+    df = df.reset_index(drop=True)
+    if len(df) == 0:
+        return df.assign(duplicate_ids=pd.Series(dtype=object))
+    index = SpatialIndex(pd.to_numeric(df['latitude'], errors='coerce'),
+                         pd.to_numeric(df['longitude'], errors='coerce'), cell_size_m=max(radius_m, 1))
+    pairs = index.pairs_within(radius_m)
+    if len(pairs) > 0:
+        prices = pd.to_numeric(df['price'], errors='coerce').to_numpy(dtype=float)
+        low = np.minimum(prices[pairs[:, 0]], prices[pairs[:, 1]])
+        same = np.abs(prices[pairs[:, 0]] - prices[pairs[:, 1]]) <= low * price_tolerance
+        for column in match_columns:
+            values = df[column].to_numpy()
+            same &= values[pairs[:, 0]] == values[pairs[:, 1]]
+        pairs = pairs[same]
+    labels = _group_labels(len(df), pairs)
+    ids = df['id'].astype(str)
+    duplicate_ids = ids.groupby(labels).agg(lambda x: ';'.join(x.iloc[1:]))
+    out = df[labels == np.arange(len(df))].copy()
+    out['duplicate_ids'] = duplicate_ids.reindex(out.index).fillna('').to_numpy()
+    logger.info(f'dedup: {len(df)} listings -> {len(out)} properties')
+    return out
+
+
+def within_radius(df: pd.DataFrame, coords: tuple, radius_m: float, index: SpatialIndex = None) -> pd.DataFrame:
+    """rows of df within radius_m of coords, nearest first
+
+    :param df: listings with latitude and longitude columns
+    :param coords: (latitude, longitude) to search around
+    :param radius_m: search radius
+    :param index: index already built over df, to reuse across several queries
+    """
+    if index is None:
+        index = SpatialIndex(pd.to_numeric(df['latitude'], errors='coerce'),
+                             pd.to_numeric(df['longitude'], errors='coerce'))
+    return df.iloc[index.query_radius(coords[0], coords[1], radius_m)]
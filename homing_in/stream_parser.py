@@ -0,0 +1,117 @@
+from collections import namedtuple
+import logging
+from typing import Dict, List
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+# a simple xpath to follow while streaming, e.g. //*[@id='description']/div/div[2]/div[1]/div/a/img is
+# Path('description', True, [('div', None), ('div', 2), ('div', 1), ('div', None), ('a', None), ('img', None)], 'src')
+# steps are (tag, position among same tag siblings or None for any), value is 'text' for the element's text (as
+# lxml's element.text) or the name of an attribute. include_root=False is the relative './/*' form, which can't
+# match the root element itself
+Path = namedtuple('Path', ['anchor_id', 'include_root', 'steps', 'value'])
+
+
+class _Element:
+    __slots__ = ['tag', 'matches', 'child_counts']
+
+    def __init__(self, tag: str, matches: Dict[str, frozenset]):
+        self.tag = tag
+        self.matches = matches  # path name to the number of its steps this element is at the end of
+        self.child_counts = {}
+
+
+class _ExtractTarget:
+    """parser target following each path down the open elements, so nothing but the current branch is kept"""
+    def __init__(self, paths: Dict[str, Path]):
+        self.paths = paths
+        self.found = {}
+        self.stack = []
+        self._text = None  # (path names, collected text) while reading the text of a matched element
+
+    @property
+    def done(self) -> bool:
+        return len(self.found) == len(self.paths) and self._text is None
+
+    def _end_text(self):
+        if self._text is not None:
+            names, parts = self._text
+            for name in names:
+                self.found[name] = ''.join(parts) if parts else None
+            self._text = None
+
+    def start(self, tag, attrib):
+        self._end_text()
+        depth = len(self.stack)
+        position = 1
+        if self.stack:
+            counts = self.stack[-1].child_counts
+            position = counts[tag] = counts.get(tag, 0) + 1
+        matches = {}
+        complete = []
+        for name, path in self.paths.items():
+            if name in self.found:
+                continue
+            steps = set()
+            if attrib.get('id') == path.anchor_id and (depth > 0 or path.include_root):
+                steps.add(0)
+            if self.stack:
+                for done in self.stack[-1].matches.get(name, ()):
+                    if done < len(path.steps):
+                        step_tag, step_position = path.steps[done]
+                        if step_tag == tag and step_position in (None, position):
+                            steps.add(done + 1)
+            if steps:
+                matches[name] = frozenset(steps)
+                if len(path.steps) in steps:
+                    complete.append(name)
+        text_names = []
+        for name in complete:
+            if self.paths[name].value == 'text':
+                text_names.append(name)
+            else:
+                self.found[name] = attrib[self.paths[name].value]
+        if text_names:
+            self._text = (text_names, [])
+        self.stack.append(_Element(tag, matches))
+
+    def data(self, data):
+        if self._text is not None:
+            self._text[1].append(data)
+
+    def end(self, tag):
+        self._end_text()
+        self.stack.pop()
+
+    def comment(self, text):
+        self._end_text()  # a comment is a child node, so it ends the element's text as a child element would
+
+    def pi(self, target, data=None):
+        self._end_text()
+
+    def close(self):
+        self._end_text()
+        return self.found
+
+
+def extract(content: bytes, paths: Dict[str, Path], chunk_size: int = 16384) -> Dict[str, List]:
+    """the first match of each path in content, without building a tree of the document
+
+    the html is fed to the parser in chunks and parsing stops once every path has been found
+
+    :return: path name to a list holding the first match's value, empty if the path wasn't found
+    """
+    target = _ExtractTarget(paths)
+    parser = etree.HTMLParser(target=target)
+    fed = 0
+    for i in range(0, len(content), chunk_size):
+        parser.feed(content[i:i + chunk_size])
+        fed = i + chunk_size
+        if target.done:
+            break
+    if fed < len(content):
+        logger.debug(f'stream parser: stopped after {fed} of {len(content)} bytes')
+    found = parser.close() if not target.done else target.found
+    return {name: [found[name]] if name in found else [] for name in paths}
@@ -0,0 +1,91 @@
+import logging
+import sqlite3
+import time
+from typing import Dict, Iterable
+
+logger = logging.getLogger(__name__)
+
+
+class TravelTimeCache:
+    """persistent memo of travel times in a sqlite file
+
+    entries are keyed on start and end coordinates rounded to precision decimal places (4 is roughly 10m, so
+    listings in the same building share an entry), the mode and the departure time bucketed to weekday and hour
+
+    :param path: sqlite file to keep travel times in
+    :param precision: decimal places coordinates are rounded to
+    :param max_entries: least recently used entries are dropped beyond this many
+    """
+    _query_chunk = 500
+
+    def __init__(self, path: str, precision: int = 4, max_entries: int = 1000000):
+        self.path = path
+        self.precision = precision
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS travel_times (
+            key TEXT PRIMARY KEY, minutes REAL, last_access REAL)""")
+        self.conn.execute('CREATE INDEX IF NOT EXISTS travel_times_last_access ON travel_times (last_access)')
+        self.conn.commit()
+
+    def quantise(self, coords: tuple) -> tuple:
+        lat, long = coords
+        return round(float(lat), self.precision), round(float(long), self.precision)
+
+    def key(self, start_coords: tuple, end_coords: tuple, departure_time: str, mode: str) -> str:
+        start_lat, start_long = self.quantise(start_coords)
+        end_lat, end_long = self.quantise(end_coords)
+        departure = time.strptime(departure_time, '%Y/%m/%d %H:%M:%S')
+        p = self.precision
+        return (f'{start_lat:.{p}f},{start_long:.{p}f}|{end_lat:.{p}f},{end_long:.{p}f}|{mode}|'
+                f'{departure.tm_wday}|{departure.tm_hour}')
+
+    def get(self, key: str):
+        """minutes for key, or None if it isn't cached"""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, float]:
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        for i in range(0, len(keys), self._query_chunk):
+            chunk = keys[i:i + self._query_chunk]
+            placeholders = ','.join('?' * len(chunk))
+            found.update(self.conn.execute(
+                f'SELECT key, minutes FROM travel_times WHERE key IN ({placeholders})', chunk).fetchall())
+        now = time.time()
+        self.conn.executemany('UPDATE travel_times SET last_access = ? WHERE key = ?', [(now, k) for k in found])
+        self.conn.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, key: str, minutes: float):
+        self.put_many({key: minutes})
+
+    def put_many(self, minutes: Dict[str, float]):
+        """store travel times, failed lookups (NaN) are not stored so they are retried next time"""
+        now = time.time()
+        rows = [(key, value, now) for key, value in minutes.items() if value == value]
+        self.conn.executemany('INSERT OR REPLACE INTO travel_times VALUES (?, ?, ?)', rows)
+        self._evict()
+        self.conn.commit()
+
+    def _evict(self):
+        excess = len(self) - self.max_entries
+        if excess > 0:
+            self.conn.execute('DELETE FROM travel_times WHERE key IN '
+                              '(SELECT key FROM travel_times ORDER BY last_access LIMIT ?)', (excess,))
+            logger.debug(f'travel time cache: evicted {excess} entries')
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self)}
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM travel_times').fetchone()[0]
+
+    def close(self):
+        self.conn.close()
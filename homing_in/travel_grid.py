@@ -0,0 +1,99 @@
+import logging
+import math
+import sqlite3
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# offsets of a cell's corners from its lower left lattice node, in the order interpolate expects them
+CORNERS = np.array([[0, 0], [0, 1], [1, 0], [1, 1]])
+
+
+class TravelTimeGrid:
+    """persistent lattice of travel times to (or from) each destination, for estimating the travel time of any
+    location in the area by interpolating between the lattice nodes around it
+
+    the lattice is fixed in latitude / longitude, so every search over the same area shares its nodes: a node's
+    travel time is requested once, the first time a location in one of its cells is looked up, and kept for good.
+    each grid is keyed on the destination, mode, direction and departure time bucketed to weekday and hour
+
+    :param path: sqlite file to keep the lattice in
+    :param cell_size: (latitude, longitude) degrees between lattice nodes, the default is roughly 550m square in london
+    :param tolerance: the most minutes the corners of a location's cell can differ by for the interpolated estimate
+        to be used, beyond it (or when a corner has no route) the exact travel time should be requested
+    """
+    def __init__(self, path: str, cell_size: Tuple[float, float] = (0.005, 0.008), tolerance: float = 6):
+        self.path = path
+        self.cell_size = cell_size
+        self.tolerance = tolerance
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS nodes (
+            grid TEXT, row INTEGER, col INTEGER, minutes REAL, PRIMARY KEY (grid, row, col))""")
+        self.conn.commit()
+
+    def key(self, coords: tuple, departure_time: str, mode: str, to_property: bool = False) -> str:
+        """the grid of travel times from every location to coords (from coords when to_property)"""
+        departure = time.strptime(departure_time, '%Y/%m/%d %H:%M:%S')
+        lat_size, long_size = self.cell_size
+        return (f'{float(coords[0]):.4f},{float(coords[1]):.4f}|{mode}|{"from" if to_property else "to"}|'
+                f'{departure.tm_wday}|{departure.tm_hour}|{lat_size:g}x{long_size:g}')
+
+    def cells(self, points: List[tuple]) -> Tuple[np.ndarray, np.ndarray]:
+        """the lattice nodes at the corners of each point's cell, as an (n, 4, 2) array of (row, col), and the point's
+        position within its cell as an (n, 2) array of (latitude, longitude) fractions"""
+        position = np.asarray(points, dtype=float).reshape(-1, 2) / np.array(self.cell_size)
+        lower_left = np.floor(position)
+        return lower_left.astype(np.int64)[:, None, :] + CORNERS, position - lower_left
+
+    def coords(self, nodes: np.ndarray) -> List[tuple]:
+        """latitude and longitude of each (row, col) node"""
+        lat_size, long_size = self.cell_size
+        return [(round(row * lat_size, 6), round(col * long_size, 6)) for row, col in nodes.tolist()]
+
+    def nodes(self, coords: List[tuple]) -> np.ndarray:
+        """(row, col) of the lattice node at each of coords"""
+        return np.rint(np.asarray(coords, dtype=float).reshape(-1, 2) / np.array(self.cell_size)).astype(np.int64)
+
+    def get_many(self, grid: str, nodes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """minutes (NaN where there is no route) at each (row, col) node of grid and whether each node is known"""
+        minutes = np.full(len(nodes), np.nan)
+        known = np.zeros(len(nodes), dtype=bool)
+        if len(nodes) == 0:
+            return minutes, known
+        # one range query for the block of nodes covering them all, a search area's nodes are close together
+        low, high = nodes.min(axis=0), nodes.max(axis=0)
+        rows = self.conn.execute(
+            'SELECT row, col, minutes FROM nodes WHERE grid = ? AND row BETWEEN ? AND ? AND col BETWEEN ? AND ?',
+            (grid, int(low[0]), int(high[0]), int(low[1]), int(high[1]))).fetchall()
+        block = np.full(high - low + 1, np.nan)
+        stored = np.zeros(high - low + 1, dtype=bool)
+        for row, col, value in rows:
+            block[row - low[0], col - low[1]] = np.nan if value is None else value
+            stored[row - low[0], col - low[1]] = True
+        offsets = tuple((nodes - low).T)
+        return block[offsets], stored[offsets]
+
+    def put_many(self, grid: str, minutes: Dict[tuple, float]):
+        """store minutes at (row, col) nodes of grid, NaN meaning there is no route from (or to) that node"""
+        rows = [(grid, int(row), int(col), None if math.isnan(value) else value)
+                for (row, col), value in minutes.items()]
+        self.conn.executemany('INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?)', rows)
+        self.conn.commit()
+
+    def interpolate(self, corners: np.ndarray, fractions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """bilinear estimate from each cell's corner minutes (an (n, 4) array in CORNERS order) at fractions within
+        it, and whether each estimate is certain: all four corners have a route and differ by at most tolerance"""
+        lat, long = fractions[:, 0], fractions[:, 1]
+        weights = np.column_stack([(1 - lat) * (1 - long), (1 - lat) * long, lat * (1 - long), lat * long])
+        estimate = np.round((corners * weights).sum(axis=1), 0)
+        spread = corners.max(axis=1) - corners.min(axis=1)  # NaN if any corner has no route, which isn't certain
+        return estimate, spread <= self.tolerance
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM nodes').fetchone()[0]
+
+    def close(self):
+        self.conn.close()
@@ -1,46 +1,327 @@
 import calendar
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import json
 import logging
 import os
 import urllib.error
 import urllib.request
 import time
+from typing import List, Union
+from urllib.parse import urlsplit
 
 from dotenv import load_dotenv, find_dotenv
 import numpy as np
+import pandas as pd
+
+from homing_in.checkpoint import Checkpoint
+from homing_in.metrics import METRICS
+from homing_in.scheduler import RequestScheduler, SCHEDULER
+from homing_in.travel_cache import TravelTimeCache
+from homing_in.travel_grid import TravelTimeGrid
 
 load_dotenv(find_dotenv())
 GOOGLE_API_KEY = os.environ.get('GOOGLE_API')
 
+DISTANCE_MATRIX_URL = 'https://maps.googleapis.com/maps/api/distancematrix/json'
+TRAVEL_MODES = ['DRIVING', 'BICYCLING', 'TRANSIT', 'WALKING']
+MAX_MATRIX_SIDE = 25  # origins or destinations per distance matrix request
+MAX_MATRIX_ELEMENTS = 100  # origins x destinations per distance matrix request
+
 logger = logging.getLogger(__name__)
 
+# a travel time column to add in travel_times, to_property=True measures the journey from coords to each property
+Target = namedtuple('Target', ['column', 'coords', 'departure_time', 'mode', 'to_property'], defaults=[False])
+
+
+def _departure_timestamp(departure_time: str) -> int:
+    return calendar.timegm(time.strptime(departure_time, '%Y/%m/%d %H:%M:%S'))
+
+
+def _coords_param(coords: List[tuple]) -> str:
+    return '|'.join(f'{lat},{long}' for lat, long in coords)
+
 
-def travel_time(start_coords: tuple, end_coords: tuple, departure_time: str, mode: str):
-    travel_modes = ['DRIVING', 'BICYCLING', 'TRANSIT', 'WALKING']
-    assert mode in travel_modes, f'mode must be one of the following: {travel_modes} (chosen: {mode})'
-    start_lat, start_long = start_coords
-    end_lat, end_long = end_coords
-    start_coords_str = f'{start_lat},{start_long}'
-    end_coords_str = f'{end_lat},{end_long}'
-    depart_time = calendar.timegm(time.strptime(departure_time, '%Y/%m/%d %H:%M:%S'))
+def _retry_reason(response: dict):
+    if response['status'] == 'OVER_QUERY_LIMIT':
+        return 'throttled'
+    if response['status'] == 'UNKNOWN_ERROR':  # google suggests retrying these
+        return 'server error'
+    return None
+
+
+def _retryable(error: Exception):
+    if isinstance(error, urllib.error.HTTPError):
+        if error.code == 429:
+            return 'throttled'
+        return f'server error {error.code}' if error.code >= 500 else None
+    if isinstance(error, urllib.error.URLError):
+        return f'connection error {error.reason}'
+    return None
+
+
+def _distance_matrix(origins: List[tuple], destinations: List[tuple], mode: str, depart_time: int,
+                     base_url: str = DISTANCE_MATRIX_URL, scheduler: RequestScheduler = None) -> Union[dict, None]:
+    """call the distance matrix api, returning the decoded response or None if the request failed"""
     full_url = (
-        f'https://maps.googleapis.com/maps/api/distancematrix/json?units=imperial&origins={start_coords_str}&'
-        f'destinations={end_coords_str}&mode={mode}&departure_time={depart_time}&key={GOOGLE_API_KEY}')
+        f'{base_url}?units=imperial&origins={_coords_param(origins)}&'
+        f'destinations={_coords_param(destinations)}&mode={mode}&departure_time={depart_time}&key={GOOGLE_API_KEY}')
     logger.debug('calling: %s' % full_url)
-    out = np.nan
+    host = urlsplit(base_url).netloc
+
+    def request():
+        METRICS.count('api_calls', api='distance_matrix')
+        METRICS.count('api_elements', len(origins) * len(destinations), api='distance_matrix')  # what google bills
+        start = time.perf_counter()
+        body = urllib.request.urlopen(full_url).read()
+        METRICS.observe_request(host, time.perf_counter() - start, len(body))
+        return json.loads(body)
+
+    try:
+        response = (scheduler or SCHEDULER).call(host, request, _retry_reason, _retryable)
+    except (urllib.error.HTTPError, urllib.error.URLError) as e:
+        logger.error(f'ERROR: {e}')
+        return None
+    if response['status'] == 'OVER_QUERY_LIMIT':
+        logger.error('OVER QUERY LIMIT')
+        return None
+    return response
+
+
+def _element_minutes(element: dict) -> float:
     try:
-        result = urllib.request.urlopen(full_url)
-        response = json.load(result)
-        if response['status'] == 'OVER_QUERY_LIMIT':
-            logger.error('OVER QUERY LIMIT')
-        else:
-            try:
-                minutes = round(response['rows'][0]['elements'][0]['duration']['value'] / 60, 0)
-                out = minutes
-            except KeyError:
-                pass
-    except urllib.error.HTTPError or urllib.error.URLError as e:
-        logger.error(f'ERROR({e.errno}): {e.strerror}')
+        return round(element['duration']['value'] / 60, 0)
+    except KeyError:
+        return np.nan
+
+
+def travel_time(start_coords: tuple, end_coords: tuple, departure_time: str, mode: str,
+                base_url: str = DISTANCE_MATRIX_URL, cache: TravelTimeCache = None, scheduler: RequestScheduler = None):
+    assert mode in TRAVEL_MODES, f'mode must be one of the following: {TRAVEL_MODES} (chosen: {mode})'
+    if cache is not None:
+        key = cache.key(start_coords, end_coords, departure_time, mode)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    response = _distance_matrix([start_coords], [end_coords], mode, _departure_timestamp(departure_time), base_url,
+                                scheduler)
+    out = np.nan
+    if response is not None:
+        try:
+            out = _element_minutes(response['rows'][0]['elements'][0])
+        except (KeyError, IndexError):
+            pass
+    if cache is not None:
+        cache.put(key, out)
     return out
 
 
+def _cache_key(cache: TravelTimeCache, point: tuple, target: Target) -> str:
+    if target.to_property:
+        return cache.key(target.coords, point, target.departure_time, target.mode)
+    return cache.key(point, target.coords, target.departure_time, target.mode)
+
+
+def _pair_unit(point: tuple, target: Target) -> str:
+    """the checkpoint unit for the travel time between point and target"""
+    return f'{target.coords}|{target.departure_time}|{target.mode}|{target.to_property}|{point[0]},{point[1]}'
+
+
+def checkpoint_job(targets: List[Target]) -> str:
+    """the name in the checkpoint of a travel_times run for targets, so runs for other targets keep their own units"""
+    lookups = sorted({(target.coords, target.departure_time, target.mode, target.to_property) for target in targets})
+    return f'travel_times:{hashlib.sha256(repr(lookups).encode("utf-8")).hexdigest()[:16]}'
+
+
+def _chunks(items: list, size: int) -> list:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _matrix_requests(points: List[tuple], targets: List[Target]) -> list:
+    """pack one group of targets (sharing departure time, mode and direction) into as few matrix requests as possible
+
+    :return: list of (target chunk, point chunk) pairs, one per request
+    """
+    batches = []
+    target_chunk_size = min(MAX_MATRIX_SIDE, MAX_MATRIX_ELEMENTS)
+    for target_chunk in _chunks(targets, target_chunk_size):
+        point_chunk_size = min(MAX_MATRIX_SIDE, MAX_MATRIX_ELEMENTS // len(target_chunk))
+        for point_chunk in _chunks(points, point_chunk_size):
+            batches.append((target_chunk, point_chunk))
+    return batches
+
+
+def _fetch_minutes(points: List[tuple], targets: List[Target], minutes: dict, max_workers: int, base_url: str,
+                   scheduler: RequestScheduler, completed=None, failed=None) -> int:
+    """request the travel times between points and targets missing from minutes (target column to point to minutes),
+    filling them in
+
+    :param completed: called with a dict of (target, point) to minutes as each request completes
+    :param failed: called with the (target, point) pairs and the error of each request that fails
+    :return: number of lookups that failed
+    """
+    groups = {}
+    for target in targets:
+        groups.setdefault((target.departure_time, target.mode, target.to_property), []).append(target)
+    calls = []
+    for (departure_time, mode, to_property), group in groups.items():
+        missing = [p for p in points if any(p not in minutes[target.column] for target in group)]
+        for target_chunk, point_chunk in _matrix_requests(missing, group):
+            calls.append((target_chunk, point_chunk, _departure_timestamp(departure_time), mode, to_property))
+    logger.info(f'travel times: {len(targets)} targets x {len(points)} locations in {len(calls)} requests')
+
+    def call(request):
+        target_chunk, point_chunk, depart_time, mode, to_property = request
+        target_coords = [t.coords for t in target_chunk]
+        try:
+            if to_property:
+                return _distance_matrix(target_coords, point_chunk, mode, depart_time, base_url, scheduler)
+            return _distance_matrix(point_chunk, target_coords, mode, depart_time, base_url, scheduler)
+        except Exception as e:  # e.g. a malformed response, the lookups are failed rather than the whole run
+            logger.error(f'ERROR: {type(e).__name__}: {e}')
+            return None
+
+    failures = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for (target_chunk, point_chunk, _, _, to_property), response in zip(calls, pool.map(call, calls)):
+            if response is None or response.get('status') != 'OK':
+                failures += len(target_chunk) * len(point_chunk)
+                if failed is not None:
+                    error = 'request failed' if response is None else f'status {response.get("status")}'
+                    failed([(target, point) for target in target_chunk for point in point_chunk], error)
+                continue
+            batch = {}
+            for i, target in enumerate(target_chunk):
+                for j, point in enumerate(point_chunk):
+                    row, col = (i, j) if to_property else (j, i)
+                    minutes[target.column][point] = _element_minutes(response['rows'][row]['elements'][col])
+                    batch[(target, point)] = minutes[target.column][point]
+            if completed is not None:
+                completed(batch)
+    return failures
+
+
+def _grid_estimates(points: List[tuple], targets: List[Target], minutes: dict, grid: TravelTimeGrid, fetch) -> int:
+    """fill in minutes for the points grid can estimate with certainty, first requesting (with fetch) and storing any
+    lattice nodes around them the grid doesn't have yet
+
+    :return: number of travel times estimated
+    """
+    cells = {}
+    node_minutes = {target.column: {} for target in targets}
+    lattice = {}
+    for target in targets:
+        pending = [p for p in points if p not in minutes[target.column]]
+        if not pending:
+            continue
+        corners, fractions = grid.cells(pending)
+        nodes, corner_nodes = np.unique(corners.reshape(-1, 2), axis=0, return_inverse=True)
+        key = grid.key(target.coords, target.departure_time, target.mode, target.to_property)
+        values, known = grid.get_many(key, nodes)
+        coords = grid.coords(nodes)
+        node_minutes[target.column] = {c: v for c, v, k in zip(coords, values, known) if k}
+        lattice.update((c, None) for c, k in zip(coords, known) if not k)
+        cells[target] = (key, pending, fractions, corner_nodes.reshape(-1, 4), coords, set(node_minutes[target.column]))
+
+    if lattice:
+        METRICS.count('travel_grid_nodes', len(lattice))
+        fetch(list(lattice), [target for target in targets if target in cells], node_minutes)
+
+    estimated = 0
+    for target, (key, pending, fractions, corner_nodes, coords, stored) in cells.items():
+        # everything fetched is stored, including nodes requested alongside another target's
+        fetched = [c for c in node_minutes[target.column] if c not in stored]
+        grid.put_many(key, dict(zip(map(tuple, grid.nodes(fetched).tolist()),
+                                    [node_minutes[target.column][c] for c in fetched])))
+        values = np.array([node_minutes[target.column].get(c, np.nan) for c in coords])
+        estimates, certain = grid.interpolate(values[corner_nodes], fractions)
+        for point, estimate, sure in zip(pending, estimates, certain):
+            if sure:
+                minutes[target.column][point] = estimate
+        estimated += int(certain.sum())
+    if points:
+        METRICS.count('travel_grid_estimates', estimated)
+        logger.info(f'travel time grid: estimated {estimated} travel times, {len(lattice)} lattice nodes requested')
+    return estimated
+
+
+@METRICS.timed('travel_times')
+def travel_times(properties: pd.DataFrame, targets: List[Target], max_workers: int = 8,
+                 base_url: str = DISTANCE_MATRIX_URL, cache: TravelTimeCache = None,
+                 scheduler: RequestScheduler = None, checkpoint: Checkpoint = None,
+                 grid: TravelTimeGrid = None) -> pd.DataFrame:
+    """add a travel time column (in minutes) to properties for every target, using batched distance matrix requests
+
+    targets sharing a departure time, mode and direction are packed together into requests of up to 25 origins x 25
+    destinations (and at most 100 elements), and the requests are sent concurrently. properties sharing coordinates
+    share a lookup
+
+    :param properties: frame with latitude and longitude columns
+    :param targets: travel time columns to add, e.g. Target('travel_time_cw', CANARY_WHARF, '2019/07/17 08:00:00',
+        'TRANSIT')
+    :param max_workers: number of requests to have in flight at once
+    :param base_url: distance matrix endpoint
+    :param cache: only request travel times missing from this cache, coordinates are rounded to the cache's
+        precision before requesting
+    :param scheduler: rate limits and retries the requests (defaults to the shared scheduler)
+    :param checkpoint: record each lookup as its request completes (and each failed request), so a run restarted
+        after a crash only requests what is left. unlike the cache, failed lookups are listed by
+        checkpoint.failures(checkpoint_job(targets)) until a rerun gets them
+    :param grid: estimate travel times by interpolating this grid's lattice, requesting only the lattice nodes it
+        doesn't have yet and the exact travel time of properties whose estimate is uncertain. once an area's lattice
+        is complete, further searches over it cost no requests beyond those uncertain properties
+    :return: copy of properties with a column added for each target
+    """
+    for target in targets:
+        assert target.mode in TRAVEL_MODES, f'mode must be one of the following: {TRAVEL_MODES} (chosen: {target.mode})'
+    lats = pd.to_numeric(properties['latitude'], errors='coerce')
+    longs = pd.to_numeric(properties['longitude'], errors='coerce')
+    property_coords = list(zip(lats, longs))
+    if cache is not None:
+        property_coords = [cache.quantise(c) for c in property_coords]
+    points = list(dict.fromkeys(c for c in property_coords if not (np.isnan(c[0]) or np.isnan(c[1]))))
+
+    minutes = {target.column: {} for target in targets}
+    if cache is not None:
+        for target in targets:
+            keys = {point: _cache_key(cache, point, target) for point in points}
+            cached = cache.get_many(keys.values())
+            minutes[target.column] = {point: cached[key] for point, key in keys.items() if key in cached}
+    job = checkpoint_job(targets)
+    if checkpoint is not None:
+        for target in targets:
+            units = {point: _pair_unit(point, target) for point in points if point not in minutes[target.column]}
+            done = checkpoint.done(job, units.values())
+            minutes[target.column].update({point: done[unit] for point, unit in units.items() if unit in done})
+    if grid is not None:
+        _grid_estimates(points, targets, minutes, grid,
+                        lambda nodes, node_targets, node_minutes: _fetch_minutes(
+                            nodes, node_targets, node_minutes, max_workers, base_url, scheduler))
+
+    fetched = {}
+
+    def completed(batch: dict):
+        if cache is not None:
+            fetched.update({_cache_key(cache, point, target): value for (target, point), value in batch.items()})
+        if checkpoint is not None:
+            checkpoint.save_many(job, {_pair_unit(point, target): value for (target, point), value in batch.items()})
+
+    def failed(pairs: list, error: str):
+        if checkpoint is not None:
+            checkpoint.fail_many(job, {_pair_unit(point, target): error for target, point in pairs})
+
+    failures = _fetch_minutes(points, targets, minutes, max_workers, base_url, scheduler, completed, failed)
+    if failures > 0:
+        logger.warning(f'travel times: {failures} lookups failed and are NaN')
+        METRICS.count('travel_time_failures', failures)
+    if cache is not None:
+        cache.put_many(fetched)
+        logger.info(f'travel time cache: {cache.stats()}')
+    if checkpoint is not None:
+        checkpoint.finish(job)
+
+    out = properties.copy()
+    for target in targets:
+        out[target.column] = [minutes[target.column].get(c, np.nan) for c in property_coords]
+    return out